@@ -0,0 +1,84 @@
+#!/usr/bin/env python
+"""Compares XML backends and extractors on a scaled-up copy of sample.xml."""
+
+import argparse
+import io
+import tempfile
+import time
+from pathlib import Path
+
+import wos_builder.extract as x
+from wos_builder.conversion import extractors, xml_to_sql
+from wos_builder.read_records import iter_records
+
+SAMPLE_XML = Path(__file__).parent.resolve() / ".." / "resources" / "sample.xml"
+
+
+def scale_sample(copies):
+    """Returns sample.xml with its records repeated copies times."""
+    sample = SAMPLE_XML.read_bytes()
+    first = sample.index(b"<REC")
+    last = sample.rindex(b"</REC>") + len(b"</REC>\n")
+    return sample[:first] + sample[first:last] * copies + sample[last:]
+
+
+def time_extraction(data, backend, extractor, repeat):
+    records = [record for _, record in iter_records(io.BytesIO(data))]
+    parse = extract = float("inf")
+    for _ in range(repeat):
+        parse_time = extract_time = 0.0
+        for record in records:
+            start = time.perf_counter()
+            REC = x.parse_record(record, backend)
+            parsed = time.perf_counter()
+            extractors[extractor](x.p_uid.first(REC).text, REC)
+            parse_time += parsed - start
+            extract_time += time.perf_counter() - parsed
+        parse = min(parse, parse_time)
+        extract = min(extract, extract_time)
+    return len(records), parse, extract
+
+
+def time_conversion(sourcefile, backend, reader):
+    with tempfile.TemporaryDirectory() as datadir:
+        start = time.perf_counter()
+        xml_to_sql(sourcefile, datadir, streaming=True, reader=reader, backend=backend)
+        return time.perf_counter() - start
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "-n", "--copies", type=int, default=20, help="Copies of the sample records"
+    )
+    parser.add_argument(
+        "-r", "--repeat", type=int, default=3, help="Repetitions, best is reported"
+    )
+    args = parser.parse_args()
+
+    available = [b for b in x.backends if b != "lxml" or x.lxml_etree is not None]
+    data = scale_sample(args.copies)
+
+    with tempfile.NamedTemporaryFile(suffix=".xml") as sourcefile:
+        sourcefile.write(data)
+        sourcefile.flush()
+
+        print("{0:.1f} MB input".format(len(data) / 1e6))
+        for backend in available:
+            for extractor in extractors:
+                n, parse, extract = time_extraction(
+                    data, backend, extractor, args.repeat
+                )
+                print(
+                    "{0:6s} {1:8s} parse {2:6.3f}s  extract {3:6.3f}s  "
+                    "{4:8.0f} records/s".format(
+                        backend, extractor, parse, extract, n / (parse + extract)
+                    )
+                )
+            for reader in ["scan", "mmap", "iterparse"]:
+                total = time_conversion(sourcefile.name, backend, reader)
+                print(
+                    "{0:6s} xml_to_sql reader={1:10s} {2:6.3f}s".format(
+                        backend, reader, total
+                    )
+                )
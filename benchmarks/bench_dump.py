@@ -0,0 +1,79 @@
+#!/usr/bin/env python
+"""Compares the SQL serialisation of SqlWriter with the former json.dumps path."""
+
+import argparse
+import json
+import os
+import tempfile
+import time
+
+import wos_builder.db_info as db_info
+import wos_builder.extract as x
+from wos_builder.conversion import extract_fused
+from wos_builder.writers import SqlWriter
+
+from bench_backends import scale_sample
+
+
+def legacy_dump(rows, header, sql_header, table_name, file_name, batch_size=1000):
+    """The serialisation dump used before the MySQL literal encoder."""
+    with open(file_name, "w") as f_handle:
+        f_handle.write(sql_header.format(table_name))
+        f_handle.write("\n")
+        for i in range(0, len(rows), batch_size):
+            batch = rows[i : i + batch_size]
+            f_handle.write(
+                "INSERT IGNORE INTO {0} ({1})\n".format(table_name, ", ".join(header))
+            )
+            f_handle.write("VALUES\n")
+            for idx, row in enumerate(batch):
+                f_handle.write("(")
+                f_handle.write(",".join([json.dumps(value) for value in row]))
+                f_handle.write(")")
+                if idx == len(batch) - 1:
+                    f_handle.write(";")
+                else:
+                    f_handle.write(",")
+                f_handle.write("\n")
+
+
+def writer_dump(rows, header, sql_header, table_name, file_name):
+    with SqlWriter(header, sql_header, table_name, file_name) as writer:
+        writer.write(rows)
+
+
+def extract_tables(sourcefile):
+    tables = {table_name: [] for table_name, _, _, _ in db_info.tables}
+    for REC in x.iter_rec_elements(sourcefile):
+        rows = extract_fused(x.p_uid.first(REC).text, REC)
+        for table_name, table_rows in rows.items():
+            tables[table_name].extend(table_rows)
+    return tables
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "-n", "--copies", type=int, default=20, help="Copies of the sample records"
+    )
+    parser.add_argument(
+        "-r", "--repeat", type=int, default=3, help="Repetitions, best is reported"
+    )
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as datadir:
+        sourcefile = os.path.join(datadir, "sample.xml")
+        with open(sourcefile, "wb") as f_handle:
+            f_handle.write(scale_sample(args.copies))
+        tables = extract_tables(sourcefile)
+        n = sum(len(rows) for rows in tables.values())
+
+        for name, dump in [("json.dumps", legacy_dump), ("SqlWriter", writer_dump)]:
+            best = float("inf")
+            for _ in range(args.repeat):
+                start = time.perf_counter()
+                for table_name, file_name, header, sql_header in db_info.tables:
+                    file_name = os.path.join(datadir, file_name + ".sql")
+                    dump(tables[table_name], header, sql_header, table_name, file_name)
+                best = min(best, time.perf_counter() - start)
+            print("{0:10s} {1:6.3f}s  {2:9.0f} rows/s".format(name, best, n / best))
@@ -0,0 +1,212 @@
+#!/usr/bin/env python
+"""Times every stage of a conversion on synthetic corpora and tracks the results.
+
+Corpora of the given sizes are generated once with synthetic.py and kept in
+--corpus-dir. Every configuration is converted --repeat times and the
+fastest run is appended to --results as one JSON line, together with the
+version of the code, so that the change against the previous run of the same
+configuration can be printed.
+"""
+
+import argparse
+import datetime
+import json
+import os
+import platform
+import subprocess
+import tempfile
+import time
+from pathlib import Path
+
+from wos_builder.conversion import xml_to_sql
+from wos_builder.read_records import iter_records
+from wos_builder.stats import Stats
+
+from synthetic import DEFAULT_SHAPE, write_corpus
+
+BENCHMARKS = Path(__file__).parent.resolve()
+
+units = {"KB": 10**3, "MB": 10**6, "GB": 10**9}
+
+
+def parse_size(text):
+    """Returns the number of bytes of a size like 10MB or 1.5GB."""
+    text = text.strip().upper()
+    for unit, factor in units.items():
+        if text.endswith(unit):
+            return int(float(text[: -len(unit)]) * factor)
+    return int(text)
+
+
+def corpus(size, seed, shape, corpus_dir):
+    """Returns the path of the corpus of size bytes, generated if missing."""
+    os.makedirs(corpus_dir, exist_ok=True)
+    name = "_".join(
+        ["synthetic", str(size), str(seed)]
+        + ["{0}{1}".format(key, mean) for key, mean in sorted(shape.items())]
+    )
+    path = os.path.join(corpus_dir, name + ".xml")
+    if not os.path.exists(path):
+        start = time.perf_counter()
+        # Written under another name first, so an interrupted run leaves nothing
+        write_corpus(path + ".part", size, seed=seed, shape=shape)
+        os.replace(path + ".part", path)
+        print("Generated {0} in {1:.1f}s".format(path, time.perf_counter() - start))
+    return path
+
+
+def time_split(sourcefile):
+    """Returns the seconds for cutting all records out of sourcefile."""
+    start = time.perf_counter()
+    with open(sourcefile, "rb") as data:
+        for _ in iter_records(data):
+            pass
+    return time.perf_counter() - start
+
+
+def time_conversion(sourcefile, **kwargs):
+    """Converts sourcefile into a temporary folder and returns the Stats summary."""
+    stats = Stats()
+    with tempfile.TemporaryDirectory() as datadir:
+        xml_to_sql(sourcefile, datadir, streaming=True, stats=stats, **kwargs)
+    return stats.summary()
+
+
+def version():
+    try:
+        return subprocess.run(
+            ["git", "describe", "--always", "--dirty"],
+            cwd=BENCHMARKS,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def previous_runs(results):
+    """Returns the last stored result of every configuration in results."""
+    last = {}
+    if os.path.exists(results):
+        with open(results) as f_handle:
+            for line in f_handle:
+                entry = json.loads(line)
+                last[json.dumps(entry["config"], sort_keys=True)] = entry
+    return last
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "-s",
+        "--size",
+        action="append",
+        default=[],
+        help="Corpus size like 1MB or 10GB. Can be repeated. Defaults to 10MB",
+    )
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the corpus")
+    parser.add_argument(
+        "--shape",
+        action="append",
+        default=[],
+        help="Mean count of a part of the records as PART=N, where PART is one of "
+        "{0}. Can be repeated".format(", ".join(DEFAULT_SHAPE)),
+    )
+    parser.add_argument(
+        "-f",
+        "--format",
+        action="append",
+        default=[],
+        help="Output format to time. Can be repeated. Defaults to sql",
+    )
+    parser.add_argument("--backend", default="auto", help="XML backend")
+    parser.add_argument("--extractor", default="classic", help="Record extractor")
+    parser.add_argument("--reader", default="scan", help="Record reader")
+    parser.add_argument(
+        "-p", "--processes", type=int, default=None, help="Worker processes"
+    )
+    parser.add_argument(
+        "-r", "--repeat", type=int, default=3, help="Repetitions, best is reported"
+    )
+    parser.add_argument(
+        "--corpus-dir",
+        default=BENCHMARKS / "corpora",
+        help="Folder of the generated corpora",
+    )
+    parser.add_argument(
+        "--results",
+        default=BENCHMARKS / "results.jsonl",
+        help="JSON Lines file the results are appended to",
+    )
+    args = parser.parse_args()
+    shape = {}
+    for value in args.shape:
+        part, _, mean = value.partition("=")
+        if part not in DEFAULT_SHAPE:
+            parser.error("Unknown part {0}".format(part))
+        shape[part] = int(mean)
+
+    last = previous_runs(args.results)
+    code_version = version()
+    for size in args.size or ["10MB"]:
+        sourcefile = corpus(parse_size(size), args.seed, shape, args.corpus_dir)
+        split = min(time_split(sourcefile) for _ in range(args.repeat))
+        for data_format in args.format or ["sql"]:
+            config = {
+                "size": parse_size(size),
+                "seed": args.seed,
+                "shape": shape,
+                "data_format": data_format,
+                "backend": args.backend,
+                "extractor": args.extractor,
+                "reader": args.reader,
+                "processes": args.processes,
+            }
+            summary = min(
+                (
+                    time_conversion(
+                        sourcefile,
+                        data_format=data_format,
+                        backend=args.backend,
+                        extractor=args.extractor,
+                        reader=args.reader,
+                        processes=args.processes,
+                    )
+                    for _ in range(args.repeat)
+                ),
+                key=lambda summary: summary["seconds"],
+            )
+            entry = {
+                "date": datetime.datetime.now().isoformat(timespec="seconds"),
+                "version": code_version,
+                "python": platform.python_version(),
+                "config": config,
+                "split_seconds": split,
+                "summary": summary,
+            }
+            with open(args.results, "a") as f_handle:
+                f_handle.write(json.dumps(entry) + "\n")
+
+            stages = "  ".join(
+                "{0} {1:.3f}s".format(stage, seconds)
+                for stage, seconds in summary["stages"].items()
+            )
+            print(
+                "{0:>6s} {1:8s} {2:7.3f}s {3:8.0f} records/s  split {4:.3f}s  {5}".format(
+                    size,
+                    data_format,
+                    summary["seconds"],
+                    summary["records_per_second"],
+                    split,
+                    stages,
+                )
+            )
+            before = last.get(json.dumps(config, sort_keys=True))
+            if before is not None:
+                change = summary["seconds"] / before["summary"]["seconds"] - 1
+                print(
+                    "       {0:+.1%} against {1} from {2}".format(
+                        change, before["version"], before["date"]
+                    )
+                )
@@ -0,0 +1,276 @@
+#!/usr/bin/env python
+"""Synthetic Web of Science records for benchmarks and tests.
+
+A CorpusGenerator takes the records of a sample file as templates and
+varies the parts that dominate the cost of a conversion: the number of
+references, authors and addresses and the length of the abstract. It also
+adds keywords, keywords plus, funding and conferences, which the sample
+lacks. References, authors and
+organizations are drawn from pools of the sample, so that cited works and
+names repeat across records like in real data. The output only depends on
+the sample and the seed.
+"""
+
+import copy
+import math
+import os
+import xml.etree.ElementTree as ET
+
+import wos_builder.extract as x
+from wos_builder.read_records import iter_records
+
+SAMPLE_XML = os.path.join(os.path.dirname(__file__), "..", "resources", "sample.xml")
+
+# Mean number of each part per record
+DEFAULT_SHAPE = {
+    "references": 30,
+    "authors": 5,
+    "addresses": 3,
+    "abstract_words": 180,
+    "keywords": 4,
+    "keywords_plus": 3,
+}
+
+# Share of records with funding and with a conference
+FUNDING_RATE = 0.3
+CONFERENCE_RATE = 0.2
+
+XML_HEADER = b'<?xml version="1.0" encoding="UTF-8"?>\n<records>\n'
+XML_FOOTER = b"</records>\n"
+
+
+class _Random:
+    """A small linear congruential generator.
+
+    random.Random would do as well, but the corpus must not change with the
+    Python version, as tests compare its conversion with stored output.
+    """
+
+    def __init__(self, seed):
+        self.state = (seed * 2654435761 + 1) % 2**64
+
+    def random(self):
+        self.state = (self.state * 6364136223846793005 + 1442695040888963407) % 2**64
+        return (self.state >> 11) / 2**53
+
+    def below(self, n):
+        return int(self.random() * n)
+
+    def choice(self, items):
+        return items[self.below(len(items))]
+
+    def count(self, mean):
+        """Returns a geometrically distributed count with the given mean."""
+        if mean <= 0:
+            return 0
+        return int(math.log(1.0 - self.random()) / math.log(mean / (mean + 1.0)))
+
+
+def _child(parent, tag, text=None, **attrib):
+    elem = ET.SubElement(parent, tag, attrib)
+    elem.text = text
+    return elem
+
+
+def _replace(parent, tag):
+    """Removes the children named tag from parent and returns a new one."""
+    index = len(parent)
+    old = parent.find(tag)
+    if old is not None:
+        index = list(parent).index(old)
+        for elem in parent.findall(tag):
+            parent.remove(elem)
+    elem = ET.Element(tag)
+    parent.insert(index, elem)
+    return elem
+
+
+class CorpusGenerator:
+    """Generates synthetic REC elements from the records in sample.
+
+    shape overrides the mean counts in DEFAULT_SHAPE. Cited works that are
+    not in the Web of Science are drawn from cited_works distinct ones.
+    """
+
+    def __init__(self, sample=SAMPLE_XML, seed=0, shape=None, cited_works=100000):
+        self.random = _Random(seed)
+        self.seed = seed
+        self.shape = dict(DEFAULT_SHAPE, **(shape or {}))
+        self.cited_works = cited_works
+        self.count = 0
+
+        with open(sample, "rb") as f_handle:
+            self.templates = [
+                ET.fromstring(record) for _, record in iter_records(f_handle)
+            ]
+        self.references = []
+        self.authors = []
+        self.addresses = []
+        self.words = []
+        for REC in self.templates:
+            self.references.extend(x.p_references.findall(REC))
+            for names in x.p_names.findall(REC):
+                self.authors.extend(
+                    name for name in names if name.get("role") == "author"
+                )
+            self.addresses.extend(
+                x.p_address_spec.first(address)
+                for address in x.p_addresses.findall(REC)
+            )
+            for title in x.p_titles.findall(REC):
+                self.words.extend((title.text or "").lower().split())
+
+    def record(self):
+        """Returns the next synthetic REC element."""
+        random = self.random
+        self.count += 1
+        REC = copy.deepcopy(random.choice(self.templates))
+        REC.find("UID").text = "WOS:SYN{0:03d}{1:010d}".format(self.seed, self.count)
+        summary = REC.find("static_data/summary")
+        metadata = REC.find("static_data/fullrecord_metadata")
+
+        # Authors and their addresses
+        authors = [
+            copy.deepcopy(random.choice(self.authors))
+            for _ in range(1 + random.count(self.shape["authors"] - 1))
+        ]
+        n_addresses = min(random.count(self.shape["addresses"]), len(authors))
+        names = _replace(summary, "names")
+        names.set("count", str(len(authors)))
+        for seq_no, author in enumerate(authors, 1):
+            author.set("seq_no", str(seq_no))
+            if n_addresses:
+                author.set("addr_no", str((seq_no - 1) % n_addresses + 1))
+            names.append(author)
+
+        addresses = _replace(metadata, "addresses")
+        addresses.set("count", str(n_addresses))
+        for addr_no in range(1, n_addresses + 1):
+            address_name = _child(addresses, "address_name")
+            spec = copy.deepcopy(random.choice(self.addresses))
+            spec.set("addr_no", str(addr_no))
+            address_name.append(spec)
+            address_names = _child(address_name, "names")
+            for author in authors:
+                if author.get("addr_no") == str(addr_no):
+                    name = _child(
+                        address_names,
+                        "name",
+                        addr_no=str(addr_no),
+                        role="author",
+                        seq_no=author.get("seq_no"),
+                    )
+                    for tag in ["display_name", "full_name"]:
+                        if author.find(tag) is not None:
+                            _child(name, tag, author.find(tag).text)
+            address_names.set("count", str(len(address_names)))
+
+        # References, with cited works outside the Web of Science from a pool
+        references = _replace(metadata, "references")
+        for _ in range(random.count(self.shape["references"])):
+            reference = copy.deepcopy(random.choice(self.references))
+            uid = reference.find("uid")
+            if uid.text.startswith("WOS"):
+                uid.text = "WOS:SYN{0:013d}".format(random.below(10**9))
+            else:
+                uid.text = "SYN.{0:09d}".format(random.below(self.cited_works))
+            references.append(reference)
+        references.set("count", str(len(references)))
+
+        # Abstract, keywords, funding and conferences
+        for tag in ["abstracts", "keywords", "fund_ack"]:
+            for elem in metadata.findall(tag):
+                metadata.remove(elem)
+        n_words = random.count(self.shape["abstract_words"])
+        summary.find("pub_info").set("has_abstract", "Y" if n_words else "N")
+        if n_words:
+            abstract_text = _child(
+                _child(_child(metadata, "abstracts", count="1"), "abstract"),
+                "abstract_text",
+            )
+            while n_words > 0:
+                length = min(n_words, 20 + random.below(100))
+                _child(abstract_text, "p", self._text(length))
+                n_words -= length
+            abstract_text.set("count", str(len(abstract_text)))
+
+        n_keywords = random.count(self.shape["keywords"])
+        if n_keywords:
+            keywords = _child(metadata, "keywords", count=str(n_keywords))
+            for _ in range(n_keywords):
+                _child(keywords, "keyword", self._text(1 + random.below(3)))
+
+        n_keywords_plus = random.count(self.shape["keywords_plus"])
+        item = REC.find("static_data/item")
+        for elem in item.findall("keywords_plus"):
+            item.remove(elem)
+        if n_keywords_plus:
+            keywords_plus = _child(item, "keywords_plus", count=str(n_keywords_plus))
+            for _ in range(n_keywords_plus):
+                _child(keywords_plus, "keyword", self._text(2).upper())
+
+        if random.random() < FUNDING_RATE:
+            fund_ack = _child(metadata, "fund_ack")
+            _child(_child(fund_ack, "fund_text"), "p", self._text(30))
+            grants = _child(fund_ack, "grants", count="1")
+            grant = _child(grants, "grant")
+            _child(grant, "grant_agency", self._text(3).title())
+            grant_ids = _child(grant, "grant_ids", count="1")
+            _child(grant_ids, "grant_id", "G{0:06d}".format(random.below(10**6)))
+
+        for elem in summary.findall("conferences"):
+            summary.remove(elem)
+        if random.random() < CONFERENCE_RATE:
+            self._conference(summary)
+        return REC
+
+    def _conference(self, summary):
+        random = self.random
+        conference = _child(
+            _child(summary, "conferences", count="1"),
+            "conference",
+            conf_id=str(random.below(10**6)),
+        )
+        _child(_child(conference, "conf_infos"), "conf_info", self._text(6).title())
+        _child(_child(conference, "conf_titles"), "conf_title", self._text(4).title())
+        year = 1990 + random.below(30)
+        _child(
+            _child(conference, "conf_dates"),
+            "conf_date",
+            "JUN {0}".format(year),
+            conf_start="{0}0601".format(year),
+            conf_end="{0}0605".format(year),
+        )
+        location = _child(_child(conference, "conf_locations"), "conf_location")
+        for tag in ["conf_host", "conf_city", "conf_state"]:
+            _child(location, tag, self._text(1).upper())
+        sponsors = _child(conference, "sponsors")
+        for _ in range(1 + random.below(3)):
+            _child(sponsors, "sponsor", self._text(3).title())
+
+    def _text(self, n_words):
+        return " ".join(self.random.choice(self.words) for _ in range(n_words))
+
+    def records(self, n=None):
+        """Yields n serialized records as bytes, or records forever."""
+        while n is None or self.count < n:
+            yield ET.tostring(self.record(), encoding="utf-8", xml_declaration=False)
+
+
+def write_corpus(path, size, sample=SAMPLE_XML, seed=0, shape=None):
+    """Writes synthetic records to path until it holds at least size bytes.
+
+    Returns the number of records written.
+    """
+    generator = CorpusGenerator(sample, seed, shape)
+    with open(path, "wb") as f_handle:
+        f_handle.write(XML_HEADER)
+        written = len(XML_HEADER)
+        for record in generator.records():
+            f_handle.write(record)
+            f_handle.write(b"\n")
+            written += len(record) + 1
+            if written >= size:
+                break
+        f_handle.write(XML_FOOTER)
+    return generator.count
@@ -9,6 +9,13 @@ setup(
     author_email="simon.stone@dartmouth.edu",
     license="MIT",
     packages=["wos_builder"],
+    extras_require={
+        "lxml": ["lxml"],
+        "parquet": ["pyarrow"],
+        "zstd": ["zstandard"],
+        "mysql": ["pymysql"],
+        "all": ["lxml", "pyarrow", "zstandard", "pymysql"],
+    },
     zip_safe=False,
     scripts=["bin/wos_xml_to_sql"],
 )
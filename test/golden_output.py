@@ -0,0 +1,145 @@
+#!/usr/bin/env python
+"""Comparison of conversion output with stored golden output.
+
+A rowset is the output of one table in canonical form: its TSV lines in
+sorted order, so that any engine, reader or number of processes that writes
+the same rows gives the same rowset. Goldens are the rowsets of every table,
+stored as one TSV file per table in a folder. engines lists the option sets
+of xml_to_sql that must all reproduce them.
+
+Run this script to write the goldens of the test corpora after an intended
+change of the output:
+
+    python test/golden_output.py test/golden
+"""
+
+import argparse
+import collections
+import os
+import sys
+import tempfile
+
+import wos_builder.db_info as db_info
+from wos_builder.conversion import xml_to_sql
+from wos_builder.extract import lxml_etree
+
+# The corpus generator lives with the benchmarks
+sys.path.insert(
+    0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "benchmarks")
+)
+from synthetic import SAMPLE_XML, write_corpus  # noqa: E402
+
+# Options of xml_to_sql by engine name, all of which must give the same rows
+engines = {
+    "default": {},
+    "etree": {"backend": "etree"},
+    "lxml": {"backend": "lxml"},
+    "fused": {"extractor": "fused"},
+    "iterparse": {"reader": "iterparse"},
+    "mmap": {"reader": "mmap"},
+    "streaming": {"streaming": True, "batch_size": 7},
+    "parallel": {"processes": 2, "chunk_size": 7},
+    "write_behind": {"streaming": True, "batch_size": 7, "write_behind": 4},
+}
+
+# Synthetic test corpus: bytes, seed and shape. A few hundred small records,
+# so that every table gets rows, including the rare funding and conferences
+SYNTHETIC_SIZE = 2_000_000
+SYNTHETIC_SEED = 1
+SYNTHETIC_SHAPE = {"references": 4, "authors": 3, "abstract_words": 30}
+
+
+def available_engines():
+    """Returns the names of the engines that can run here."""
+    return [name for name in engines if name != "lxml" or lxml_etree is not None]
+
+
+def write_test_corpora(folder):
+    """Writes the test corpora to folder and returns their paths by name."""
+    synthetic = os.path.join(folder, "synthetic.xml")
+    write_corpus(synthetic, SYNTHETIC_SIZE, seed=SYNTHETIC_SEED, shape=SYNTHETIC_SHAPE)
+    return {"sample": os.path.abspath(SAMPLE_XML), "synthetic": synthetic}
+
+
+def read_rowsets(datadir, tables=db_info.tables):
+    """Returns the sorted TSV lines of every table written to datadir."""
+    rowsets = {}
+    for table_name, file_name, _, _ in tables:
+        with open(
+            os.path.join(datadir, file_name + ".tsv"), encoding="utf-8", newline=""
+        ) as f_handle:
+            rowsets[table_name] = sorted(f_handle.read().splitlines())
+    return rowsets
+
+
+def convert_rowsets(sourcefile, **options):
+    """Converts sourcefile with the options of xml_to_sql and returns its rowsets."""
+    with tempfile.TemporaryDirectory() as datadir:
+        xml_to_sql(sourcefile, datadir, data_format="tsv", **options)
+        return read_rowsets(datadir)
+
+
+def write_golden(rowsets, folder):
+    os.makedirs(folder, exist_ok=True)
+    for table_name, rows in rowsets.items():
+        with open(
+            os.path.join(folder, table_name + ".tsv"), "w", encoding="utf-8", newline=""
+        ) as f_handle:
+            f_handle.writelines(row + "\n" for row in rows)
+
+
+def read_golden(folder):
+    rowsets = {}
+    for table_name, _, _, _ in db_info.tables:
+        with open(
+            os.path.join(folder, table_name + ".tsv"), encoding="utf-8", newline=""
+        ) as f_handle:
+            rowsets[table_name] = f_handle.read().splitlines()
+    return rowsets
+
+
+def diff_rowsets(expected, actual):
+    """Compares two rowsets table by table and row by row.
+
+    Returns a dict of the tables that differ, mapping each to the rows that
+    are missing from actual and the rows that are not in expected. Rows
+    that occur more often in one than in the other count as well.
+    """
+    diffs = {}
+    for table_name in sorted(set(expected) | set(actual)):
+        want = collections.Counter(expected.get(table_name, []))
+        have = collections.Counter(actual.get(table_name, []))
+        missing = sorted((want - have).elements())
+        unexpected = sorted((have - want).elements())
+        if missing or unexpected:
+            diffs[table_name] = (missing, unexpected)
+    return diffs
+
+
+def format_diff(diffs, limit=5):
+    """Describes the result of diff_rowsets, with up to limit rows per table."""
+    lines = []
+    for table_name, (missing, unexpected) in diffs.items():
+        lines.append(
+            "{0}: {1} rows missing, {2} rows unexpected".format(
+                table_name, len(missing), len(unexpected)
+            )
+        )
+        lines.extend("  - " + row for row in missing[:limit])
+        lines.extend("  + " + row for row in unexpected[:limit])
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("folder", help="Folder of the goldens, e.g. test/golden")
+    parser.add_argument(
+        "-e", "--engine", default="default", help="Engine that writes the goldens"
+    )
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as corpora:
+        for name, sourcefile in write_test_corpora(corpora).items():
+            rowsets = convert_rowsets(sourcefile, **engines[args.engine])
+            write_golden(rowsets, os.path.join(args.folder, name))
+            print("Wrote {0} rows of {1}".format(sum(map(len, rowsets.values())), name))
@@ -1,4 +1,48 @@
-from wos_builder.conversion import xml_to_sql
+import wos_builder.conversion as conversion
+from wos_builder.conversion import extract_record_rows, xml_to_sql
+from wos_builder.database import DatabaseSink, xml_to_db
+from wos_builder.db_info import (
+    h_keywords,
+    h_publications,
+    t_keywords,
+    t_publications,
+    tables,
+)
+from wos_builder.extract import iter_rec_elements, lxml_etree, p_uid
+from wos_builder.fused import extract_fused
+from wos_builder.manifest import Manifest
+from wos_builder.parallel import convert_files, find_source_files
+from wos_builder.read_records import get_record, iter_mapped_records, iter_records
+from wos_builder.sources import open_source
+from wos_builder.stats import Stats
+from wos_builder.writers import (
+    BackgroundWriter,
+    JsonlWriter,
+    ParquetWriter,
+    SqlWriter,
+    compressions,
+    mysql_int,
+    mysql_string,
+    tsv_row,
+)
+
+import bz2
+import contextlib
+import gzip
+import io
+import json
+import shutil
+import sqlite3
+import threading
+import zipfile
+import xml.etree.ElementTree as ET
+
+import pytest
+
+import golden_output as golden
+
+# golden_output has put the benchmarks folder on the path
+from synthetic import CorpusGenerator, write_corpus
 
 from pathlib import Path
 
@@ -13,5 +57,785 @@ def test_xml_to_sql():
     xml_to_sql(TEST_XML, OUT_DIR)
 
 
+def test_xml_to_sql_streaming(tmp_path):
+    xml_to_sql(TEST_XML, tmp_path, streaming=True, batch_size=7)
+    xml_to_sql(TEST_XML, OUT_DIR, batch_size=7)
+    for sql_file in Path(OUT_DIR).glob("*.sql"):
+        assert (tmp_path / sql_file.name).read_text() == sql_file.read_text()
+
+
+def test_mapped_records(tmp_path):
+    with open(TEST_XML, "rb") as data:
+        records = list(iter_records(data))
+    mapped = list(iter_mapped_records(TEST_XML))
+    assert [(offset, bytes(record)) for offset, record in mapped] == records
+    offset = records[3][0]
+    assert next(iter_mapped_records(TEST_XML, offset))[0] == offset
+
+    (tmp_path / "empty.xml").write_bytes(b"")
+    assert list(iter_mapped_records(tmp_path / "empty.xml")) == []
+    gz = tmp_path / "sample.xml.gz"
+    gz.write_bytes(gzip.compress(TEST_XML.read_bytes()))
+    with pytest.raises(ValueError, match="uncompressed"):
+        xml_to_sql(gz, tmp_path, reader="mmap")
+
+
+def test_xml_to_sql_iterparse(tmp_path):
+    xml_to_sql(TEST_XML, tmp_path, reader="iterparse")
+    xml_to_sql(TEST_XML, OUT_DIR)
+    for sql_file in Path(OUT_DIR).glob("*.sql"):
+        assert (tmp_path / sql_file.name).read_text() == sql_file.read_text()
+
+
+@pytest.mark.parametrize("reader", ["scan", "mmap", "iterparse"])
+def test_xml_to_sql_lxml(tmp_path, reader):
+    pytest.importorskip("lxml")
+    xml_to_sql(TEST_XML, tmp_path, reader=reader, backend="lxml")
+    xml_to_sql(TEST_XML, OUT_DIR, reader=reader, backend="etree")
+    for sql_file in Path(OUT_DIR).glob("*.sql"):
+        assert (tmp_path / sql_file.name).read_text() == sql_file.read_text()
+
+
+@pytest.mark.parametrize(
+    "backend",
+    [
+        "etree",
+        pytest.param(
+            "lxml",
+            marks=pytest.mark.skipif(not lxml_etree, reason="lxml not installed"),
+        ),
+    ],
+)
+def test_extract_fused(backend):
+    for REC in iter_rec_elements(TEST_XML, backend):
+        wos_id = p_uid.first(REC).text
+        assert extract_fused(wos_id, REC) == extract_record_rows(wos_id, REC)
+
+
+EDGE_CASE_REC = """<REC><UID>WOS:1</UID><static_data><summary>
+<pub_info pubyear="2000"><page begin="1"/></pub_info>
+<names><name seq_no="1"><full_name>A</full_name></name><name seq_no="2"/></names>
+<conferences><conference conf_id="7">
+<conf_dates><conf_date conf_start="1"/></conf_dates><conf_dates><conf_dates>May</conf_dates></conf_dates>
+<conf_locations><conf_location><conf_host>H</conf_host></conf_location>
+<conf_location><conf_city>C</conf_city><conf_host>X</conf_host></conf_location></conf_locations>
+<sponsors><sponsor>S1</sponsor><sponsor>S2</sponsor></sponsors>
+</conference></conferences>
+</summary><fullrecord_metadata>
+<addresses><address_name><address_spec addr_no="1"><city>Z</city>
+<organizations><organization>O1</organization><organization>O2</organization></organizations>
+</address_spec><names><name seq_no="1" addr_no="1"/></names></address_name></addresses>
+<references><reference><citedAuthor>Q</citedAuthor></reference>
+<reference><uid>X:1</uid><citedAuthor>B</citedAuthor><year>1999</year><uid>X:2</uid></reference>
+<reference><uid>WOS:2</uid></reference></references>
+<fund_ack><fund_text><p>one</p></fund_text><grants><grant><grant_agency>G</grant_agency></grant>
+<grant><grant_ids><grant_id>1</grant_id><grant_id>2</grant_id></grant_ids></grant></grants></fund_ack>
+<fund_ack><fund_text><p>two</p></fund_text></fund_ack>
+</fullrecord_metadata></static_data>
+<dynamic_data><ic_related><oases><oas type="gold">Yes</oas></oases></ic_related></dynamic_data>
+</REC>"""
+
+
+def test_extract_fused_edge_cases():
+    REC = ET.fromstring(EDGE_CASE_REC)
+    assert extract_fused("WOS:1", REC) == extract_record_rows("WOS:1", REC)
+
+
+def test_xml_to_sql_processes(tmp_path):
+    xml_to_sql(TEST_XML, tmp_path, streaming=True, processes=3, chunk_size=4)
+    xml_to_sql(TEST_XML, OUT_DIR)
+    for sql_file in Path(OUT_DIR).glob("*.sql"):
+        assert (tmp_path / sql_file.name).read_text() == sql_file.read_text()
+
+
+def test_iter_records():
+    with open(TEST_XML, "r") as data:
+        expected = []
+        while record := get_record(data):
+            expected.append(record.strip().encode())
+
+    raw = TEST_XML.read_bytes()
+    for buffer_size in [5, 4096, 1 << 22]:
+        records = list(iter_records(io.BytesIO(raw), buffer_size))
+        assert [record for _, record in records] == expected
+        for offset, record in records:
+            assert raw[offset : offset + len(record)] == record
+
+    inline = b'<records><RECORDS/><REC a="1"><UID>1</UID></REC><REC><UID>2</UID></REC>'
+    for buffer_size in range(1, len(inline) + 1):
+        records = [r for _, r in iter_records(io.BytesIO(inline), buffer_size)]
+        assert records == [b'<REC a="1"><UID>1</UID></REC>', b"<REC><UID>2</UID></REC>"]
+
+
+def test_mysql_literals(tmp_path):
+    assert mysql_string("NULL") == "NULL"
+    assert mysql_string(None) == "NULL"
+    assert mysql_string("O'Brien") == "'O\\'Brien'"
+    assert mysql_string("a\\b\nc\x1a\0") == "'a\\\\b\\nc\\Z\\0'"
+    assert mysql_string("Müller") == "'Müller'"
+    assert mysql_int("791") == "791"
+    assert mysql_int("e1234") == "'e1234'"
+    assert mysql_int("NULL") == "NULL"
+
+    rows = [("1", "NULL"), ("2", "it's"), ("3", None)]
+    with SqlWriter(h_keywords, t_keywords, "kw", tmp_path / "kw.sql") as writer:
+        writer.write(rows)
+    assert (tmp_path / "kw.sql").read_text().splitlines()[-3:] == [
+        "('1',NULL),",
+        "('2','it\\'s'),",
+        "('3',NULL);",
+    ]
+
+
+def test_sql_writer_max_bytes(tmp_path):
+    rows = [(str(i), "x" * i) for i in range(200)]
+    with SqlWriter(
+        h_keywords, t_keywords, "kw", tmp_path / "kw.sql", max_bytes=1000
+    ) as writer:
+        writer.write(rows)
+
+    text = (tmp_path / "kw.sql").read_text()
+    statements = text[text.index("INSERT") :].split(";\n")[:-1]
+    assert sum(statement.count("\n(") for statement in statements) == len(rows)
+    for statement in statements:
+        assert len((statement + ";\n").encode()) <= 1000
+
+
+class _GatedWriter:
+    file_name = "gated"
+
+    def __init__(self):
+        self.gate = threading.Event()
+        self.rows = []
+
+    def write(self, rows):
+        self.gate.wait()
+        if rows == ["bad"]:
+            raise ValueError("bad row")
+        self.rows.extend(rows)
+
+    def flush(self):
+        pass
+
+    def close(self):
+        pass
+
+
+def test_parquet_lost_values(tmp_path, caplog):
+    pq = pytest.importorskip("pyarrow.parquet")
+    rows = []
+    for begin, page_count in [("12", 3), ("e1234", "NULL"), ("S12", str(2**32))]:
+        row = dict.fromkeys(h_publications, "NULL")
+        row.update(wos_id="WOS:" + begin, begin=begin, page_count=page_count)
+        rows.append(tuple(row[column] for column in h_publications))
+    path = tmp_path / "publications.parquet"
+    with ParquetWriter(h_publications, t_publications, "publications", path) as writer:
+        writer.write(rows)
+
+    table = pq.read_table(path)
+    assert table.column("begin").to_pylist() == [12, None, None]
+    assert table.column("page_count").to_pylist() == [3, None, None]
+    assert writer.lost == {"begin": 2, "page_count": 1}
+    assert "2 values of publications.begin" in caplog.text
+
+
+def test_jsonl_lost_values(tmp_path, caplog):
+    rows = []
+    for begin, page_count in [("12", 3), ("e1234", "NULL"), ("S12", str(2**32))]:
+        row = dict.fromkeys(h_publications, "NULL")
+        row.update(wos_id="WOS:" + begin, begin=begin, page_count=page_count)
+        rows.append(tuple(row[column] for column in h_publications))
+    path = tmp_path / "publications.jsonl"
+    with JsonlWriter(h_publications, t_publications, "publications", path) as writer:
+        writer.write(rows)
+
+    lines = [json.loads(line) for line in path.read_text().splitlines()]
+    assert [line["begin"] for line in lines] == [12, None, None]
+    assert [line["page_count"] for line in lines] == [3, None, None]
+    assert writer.lost == {"begin": 2, "page_count": 1}
+    assert "2 values of publications.begin" in caplog.text
+
+
+def test_background_writer(tmp_path):
+    rows = [(str(i), "x" * i) for i in range(50)]
+    with SqlWriter(
+        h_keywords, t_keywords, "kw", tmp_path / "kw.sql", batch_size=3
+    ) as writer:
+        writer.write(rows)
+    with BackgroundWriter(
+        SqlWriter(h_keywords, t_keywords, "kw", tmp_path / "bg.sql", batch_size=3),
+        1,
+        batch_rows=4,
+    ) as writer:
+        for row in rows:
+            writer.write([row])
+        writer.flush()
+        assert (tmp_path / "bg.sql").read_text() == (tmp_path / "kw.sql").read_text()
+
+    # A full queue blocks the caller until the writer catches up
+    gated = _GatedWriter()
+    writer = BackgroundWriter(gated, 2, batch_rows=1)
+    sender = threading.Thread(target=lambda: [writer.write([i]) for i in range(10)])
+    sender.start()
+    sender.join(0.2)
+    assert sender.is_alive() and writer.tasks.qsize() == 2
+    gated.gate.set()
+    sender.join()
+    writer.flush()
+    assert gated.rows == list(range(10))
+
+    writer.write(["bad"])
+    with pytest.raises(ValueError, match="bad row"):
+        writer.flush()
+    with pytest.raises(ValueError, match="bad row"):
+        writer.close()
+
+
+@pytest.mark.parametrize("options", [{}, {"streaming": True, "write_behind": True}])
+def test_xml_to_sql_write_error(tmp_path, monkeypatch, options):
+    def fail(self, rows):
+        raise OSError("disk full")
+
+    monkeypatch.setattr(SqlWriter, "write", fail)
+    with pytest.raises(OSError, match="disk full"):
+        xml_to_sql(TEST_XML, tmp_path, **options)
+
+
+def test_convert_files(tmp_path):
+    src = tmp_path / "src"
+    src.mkdir()
+    shutil.copy(TEST_XML, src / "a.xml")
+    shutil.copy(TEST_XML, src / "b.xml")
+
+    xml_to_sql(TEST_XML, OUT_DIR)
+    convert_files(src, tmp_path / "shards", processes=2)
+    for sql_file in Path(OUT_DIR).glob("*.sql"):
+        for shard in ["a", "b"]:
+            assert (tmp_path / "shards" / shard / sql_file.name).read_text() == (
+                sql_file.read_text()
+            )
+
+    convert_files(str(src / "*.xml"), tmp_path / "merged", processes=2, merge=True)
+    assert not (tmp_path / "merged" / "a").exists()
+    merged = (tmp_path / "merged" / "publications.sql").read_text()
+    single = (Path(OUT_DIR) / "publications.sql").read_text()
+    assert merged.count("INSERT IGNORE") == 2 * single.count("INSERT IGNORE")
+    assert merged.count("CREATE TABLE") == 1
+
+
+def test_tsv_output(tmp_path):
+    assert tsv_row(("a", "b c")) == "a\tb c\n"
+    assert tsv_row(("NULL", None, "x\ty\nz\\")) == "\\N\t\\N\tx\\ty\\nz\\\\\n"
+
+    xml_to_sql(TEST_XML, tmp_path, data_format="tsv")
+    xml_to_sql(TEST_XML, OUT_DIR)
+    sql = (Path(OUT_DIR) / "subjects.sql").read_text()
+    lines = (tmp_path / "subjects.tsv").read_text().splitlines()
+    assert lines and len(lines) == sql.count("\n(")
+    assert all(line.count("\t") == 2 for line in lines)
+
+    loader = (tmp_path / "load.sql").read_text()
+    assert loader.count("LOAD DATA LOCAL INFILE") == loader.count("CREATE TABLE")
+    assert "LOAD DATA LOCAL INFILE 'subjects.tsv'" in loader
+
+
+@pytest.mark.parametrize("compression", [None, "gzip", "zstd"])
+def test_jsonl_output(tmp_path, compression):
+    if compression == "zstd":
+        zstandard = pytest.importorskip("zstandard")
+    xml_to_sql(
+        TEST_XML, tmp_path, streaming=True, data_format="jsonl", compression=compression
+    )
+    xml_to_sql(TEST_XML, tmp_path, data_format="tsv")
+
+    path = tmp_path / "publications.jsonl"
+    if compression == "gzip":
+        text = gzip.decompress((tmp_path / "publications.jsonl.gz").read_bytes())
+    elif compression == "zstd":
+        with zstandard.open(tmp_path / "publications.jsonl.zst", "rb") as f_handle:
+            text = f_handle.read()
+    else:
+        text = path.read_bytes()
+    rows = [json.loads(line) for line in text.decode().splitlines()]
+
+    tsv = (tmp_path / "publications.tsv").read_text().splitlines()
+    assert rows and len(rows) == len(tsv)
+    assert list(rows[0]) == h_publications
+    assert all(row["wos_id"] for row in rows)
+    assert any(row["issue"] is None for row in rows)
+    assert any(isinstance(row["page_count"], int) for row in rows)
+
+
+def test_parquet_output(tmp_path):
+    pq = pytest.importorskip("pyarrow.parquet")
+    xml_to_sql(TEST_XML, tmp_path, data_format="parquet", batch_size=20)
+    xml_to_sql(TEST_XML, tmp_path, data_format="tsv")
+
+    parquet = pq.ParquetFile(tmp_path / "publications.parquet")
+    table = parquet.read()
+    tsv = (tmp_path / "publications.tsv").read_text().splitlines()
+    assert table.column_names == h_publications
+    assert table.num_rows == len(tsv)
+    assert parquet.metadata.num_row_groups == -(-len(tsv) // 20)
+    assert str(table.schema.field("page_count").type) == "uint32"
+    assert str(table.schema.field("pubyear").type) == "string"
+    assert table.column("wos_id").null_count == 0
+    assert parquet.metadata.row_group(0).column(0).statistics.has_min_max
+
+    src = tmp_path / "src"
+    src.mkdir()
+    shutil.copy(TEST_XML, src / "a.xml")
+    shutil.copy(TEST_XML, src / "b.xml")
+    convert_files(src, tmp_path / "merged", data_format="parquet", merge=True)
+    merged = pq.read_table(tmp_path / "merged" / "publications")
+    assert merged.num_rows == 2 * len(tsv)
+
+
+@pytest.mark.parametrize("compression", ["gzip", "zstd"])
+def test_compressed_output(tmp_path, compression):
+    if compression == "zstd":
+        pytest.importorskip("zstandard")
+    plain = tmp_path / "plain"
+    plain.mkdir()
+    xml_to_sql(TEST_XML, plain, batch_size=7)
+    packed = tmp_path / "packed"
+    packed.mkdir()
+    xml_to_sql(
+        TEST_XML,
+        packed,
+        streaming=True,
+        batch_size=7,
+        compression=compression,
+        compression_level=1,
+    )
+
+    suffix = compressions[compression]
+    for _, file_name, _, _ in tables:
+        with open_source(packed / (file_name + ".sql" + suffix)) as f_handle:
+            assert f_handle.read() == (plain / (file_name + ".sql")).read_bytes()
+
+    src = tmp_path / "src"
+    src.mkdir()
+    shutil.copy(TEST_XML, src / "a.xml")
+    shutil.copy(TEST_XML, src / "b.xml")
+    convert_files(
+        src, tmp_path / "merged", merge=True, batch_size=7, compression=compression
+    )
+    with open_source(tmp_path / "merged" / ("publications.sql" + suffix)) as f_handle:
+        merged = f_handle.read().decode()
+    assert merged.count("CREATE TABLE") == 1
+    assert merged.count("INSERT") == 2 * (
+        (plain / "publications.sql").read_text().count("INSERT")
+    )
+
+    if compression == "zstd":
+        pq = pytest.importorskip("pyarrow.parquet")
+        xml_to_sql(TEST_XML, packed, data_format="parquet", compression=compression)
+        parquet = pq.ParquetFile(packed / "publications.parquet")
+        assert parquet.metadata.row_group(0).column(0).compression == "ZSTD"
+    with pytest.raises(ValueError):
+        xml_to_sql(TEST_XML, packed, data_format="tsv", compression=compression)
+
+
+def test_xml_to_db(tmp_path):
+    def connect():
+        return sqlite3.connect(tmp_path / "wos.db", timeout=60, check_same_thread=False)
+
+    xml_to_db(TEST_XML, connect, dialect="sqlite", batch_size=7, pool_size=3)
+    xml_to_sql(TEST_XML, tmp_path, data_format="tsv")
+
+    with contextlib.closing(connect()) as db:
+        for table_name, file_name, _, _ in tables:
+            count = db.execute("SELECT count(*) FROM " + table_name).fetchone()[0]
+            lines = (tmp_path / (file_name + ".tsv")).read_text().splitlines()
+            assert count <= len(lines)
+            assert bool(count) == bool(lines)
+
+        wos_ids = {
+            line.split("\t")[0]
+            for line in (tmp_path / "publications.tsv").read_text().splitlines()
+        }
+        assert db.execute("SELECT count(*) FROM publications").fetchone()[0] == len(
+            wos_ids
+        )
+        assert db.execute(
+            "SELECT count(*) FROM publications WHERE issue IS NULL"
+        ).fetchone()[0]
+        assert db.execute(
+            "SELECT count(*) FROM publications WHERE typeof(page_count) = 'integer'"
+        ).fetchone()[0]
+
+
+def test_xml_to_db_error(tmp_path):
+    def connect():
+        return sqlite3.connect(tmp_path / "wos.db", check_same_thread=False)
+
+    # Without the tables every insert fails
+    with pytest.raises(sqlite3.OperationalError):
+        with DatabaseSink(connect, "sqlite", batch_size=1, create=False) as sink:
+            for _ in range(100):
+                sink.write(
+                    "publications", [("WOS:1",) + ("NULL",) * (len(h_publications) - 1)]
+                )
+
+
+@pytest.mark.parametrize(
+    "processes, reader", [(None, "scan"), (2, "scan"), (None, "mmap")]
+)
+def test_xml_to_sql_resume(tmp_path, monkeypatch, processes, reader):
+    options = dict(
+        streaming=True,
+        data_format="tsv",
+        processes=processes,
+        chunk_size=5,
+        reader=reader,
+    )
+    (tmp_path / "full").mkdir()
+    xml_to_sql(TEST_XML, tmp_path / "full", **options)
+
+    # Interrupt the conversion at the 5th checkpoint, after rows were written
+    # since the 4th
+    checkpoint = conversion._checkpoint
+    calls = []
+
+    def interrupt(*args):
+        calls.append(args)
+        if len(calls) == 5:
+            raise KeyboardInterrupt
+        checkpoint(*args)
+
+    resumed = tmp_path / "resumed"
+    resumed.mkdir()
+    with monkeypatch.context() as m:
+        m.setattr(conversion, "_checkpoint", interrupt)
+        with pytest.raises(KeyboardInterrupt):
+            xml_to_sql(TEST_XML, resumed, resume=True, checkpoint_bytes=1, **options)
+
+    progress = Manifest(resumed).resume_point(
+        TEST_XML, {"data_format": "tsv", "compression": None}
+    )
+    assert 0 < progress["offset"] < TEST_XML.stat().st_size
+
+    # Checkpoints are counted from the resume offset
+    shutil.copytree(resumed, tmp_path / "copy")
+    calls.clear()
+    with monkeypatch.context() as m:
+        m.setattr(conversion, "_checkpoint", lambda *args: calls.append(args))
+        xml_to_sql(
+            TEST_XML,
+            tmp_path / "copy",
+            resume=True,
+            checkpoint_bytes=progress["offset"],
+            **options,
+        )
+    assert not calls or calls[0][1] - progress["offset"] >= progress["offset"]
+
+    xml_to_sql(TEST_XML, resumed, resume=True, checkpoint_bytes=1, **options)
+    for tsv_file in (tmp_path / "full").glob("*.tsv"):
+        assert (resumed / tsv_file.name).read_text() == tsv_file.read_text()
+    assert Manifest(resumed).is_done(
+        TEST_XML, {"data_format": "tsv", "compression": None}
+    )
+
+    # A finished file is skipped without reading it
+    monkeypatch.setattr(conversion, "iter_tables", None)
+    monkeypatch.setattr(conversion, "iter_tables_parallel", None)
+    xml_to_sql(TEST_XML, resumed, resume=True, **options)
+
+
+@pytest.mark.parametrize("processes", [None, 2])
+def test_xml_to_sql_delta(tmp_path, processes):
+    index = tmp_path / "index.db"
+    for name in ["first", "again", "changed", "full"]:
+        (tmp_path / name).mkdir()
+
+    xml_to_sql(TEST_XML, tmp_path / "full")
+    xml_to_sql(TEST_XML, tmp_path / "first", processes=processes, delta_index=index)
+    for sql_file in (tmp_path / "full").glob("*.sql"):
+        assert (tmp_path / "first" / sql_file.name).read_text() == sql_file.read_text()
+
+    # Nothing changed
+    xml_to_sql(TEST_XML, tmp_path / "again", processes=processes, delta_index=index)
+    for sql_file in (tmp_path / "again").glob("*.sql"):
+        text = sql_file.read_text()
+        assert "INSERT" not in text and "DELETE" not in text
+
+    # Drop the first reference of a record
+    text = TEST_XML.read_text()
+    start = text.index("<reference>")
+    end = text.index("</reference>", start) + len("</reference>")
+    uid = text[text.rindex("<UID>", 0, start) + 5 : text.rindex("</UID>", 0, start)]
+    changed_xml = tmp_path / "changed.xml"
+    changed_xml.write_text(text[:start] + text[end:])
+    xml_to_sql(
+        changed_xml, tmp_path / "changed", processes=processes, delta_index=index
+    )
+
+    refs = (tmp_path / "changed" / "references.sql").read_text()
+    assert "DELETE FROM refs WHERE wos_id IN ('{0}');".format(uid) in refs
+    full = (tmp_path / "full" / "references.sql").read_text()
+    assert refs.count("\n('") == full.count("\n('{0}'".format(uid)) - 1
+    for sql_file in (tmp_path / "changed").glob("*.sql"):
+        if sql_file.name != "references.sql":
+            assert "INSERT" not in sql_file.read_text()
+
+
+@pytest.mark.parametrize("streaming", [False, True])
+def test_xml_to_sql_delta_repeated_record(tmp_path, streaming):
+    # A record with several references comes again later without the first
+    text = TEST_XML.read_text()
+    start = text.index("<reference>")
+    while text.count("<reference>", start, text.index("</REC>", start)) < 2:
+        start = text.index("<reference>", text.index("</REC>", start))
+    end = text.index("</reference>", start) + len("</reference>")
+    rec_start = text.rindex("<REC", 0, start)
+    rec_end = text.index("</REC>", start) + len("</REC>")
+    uid = text[text.rindex("<UID>", 0, start) + 5 : text.rindex("</UID>", 0, start)]
+    last = text.rindex("</REC>") + len("</REC>")
+    twice = tmp_path / "twice.xml"
+    twice.write_text(
+        text[:last] + "\n" + text[rec_start:start] + text[end:rec_end] + text[last:]
+    )
+    xml_to_sql(
+        twice,
+        tmp_path,
+        streaming=streaming,
+        delta_index=tmp_path / "index.db",
+    )
+
+    refs = (tmp_path / "references.sql").read_text()
+    delete = "DELETE FROM refs WHERE wos_id IN ('{0}');".format(uid)
+    before, after = refs.split(delete)
+    n_refs = before.count("\n('{0}'".format(uid))
+    assert n_refs > 1
+    assert after.count("\n('{0}'".format(uid)) == n_refs - 1
+
+
+@pytest.mark.parametrize("dedup", [True, "keys.db"])
+def test_xml_to_sql_dedup(tmp_path, dedup):
+    if dedup is not True:
+        dedup = tmp_path / dedup
+    # Every record twice
+    text = TEST_XML.read_text()
+    start = text.index("<REC")
+    end = text.rindex("</REC>") + len("</REC>")
+    doubled = tmp_path / "doubled.xml"
+    doubled.write_text(text[:end] + text[start:])
+    for name in ["full", "dedup", "again"]:
+        (tmp_path / name).mkdir()
+    xml_to_sql(doubled, tmp_path / "full", data_format="tsv")
+    xml_to_sql(doubled, tmp_path / "dedup", data_format="tsv", dedup=dedup)
+
+    for _, file_name, _, _ in tables:
+        full = (tmp_path / "full" / (file_name + ".tsv")).read_text().splitlines()
+        lines = (tmp_path / "dedup" / (file_name + ".tsv")).read_text().splitlines()
+        assert set(lines) == set(full)
+        if file_name in ["publications", "publishers", "institutions"]:
+            assert full and len(lines) == len(set(full))
+        elif file_name == "editions":
+            assert len(lines) == len(full)
+
+    # Only the database remembers the keys of the previous run
+    xml_to_sql(TEST_XML, tmp_path / "again", data_format="tsv", dedup=dedup)
+    publications = (tmp_path / "again" / "publications.tsv").read_text()
+    assert bool(publications) == (dedup is True)
+
+    with pytest.raises(ValueError):
+        xml_to_sql(TEST_XML, tmp_path, dedup=True, delta_index=tmp_path / "index.db")
+
+
+def test_xml_to_sql_normalize(tmp_path):
+    ids = tmp_path / "ids.db"
+    for name in ["full", "first", "again"]:
+        (tmp_path / name).mkdir()
+    xml_to_sql(TEST_XML, tmp_path / "full", data_format="tsv")
+    xml_to_sql(TEST_XML, tmp_path / "first", data_format="tsv", normalize=ids)
+
+    def read(name, file_name):
+        text = (tmp_path / name / (file_name + ".tsv")).read_text()
+        return [line.split("\t") for line in text.splitlines()]
+
+    loader = (tmp_path / "first" / "load.sql").read_text()
+    assert "persons" in loader and "institutions" not in loader
+    assert not (tmp_path / "first" / "contributors.tsv").exists()
+
+    # Joining the normalized tables gives back the original rows
+    for fact, dimension, original in [
+        ("addresses", "organizations", "institutions"),
+        ("authorships", "persons", "contributors"),
+    ]:
+        dimension_rows = {row[0]: row[1:] for row in read("first", dimension)}
+        assert len(dimension_rows) == len(read("first", dimension))
+        assert sorted(map(int, dimension_rows)) == list(
+            range(1, len(dimension_rows) + 1)
+        )
+        full = read("full", original)
+        joined = read("first", fact)
+        assert len(joined) == len(full)
+        if fact == "addresses":
+            assert [row[:2] + dimension_rows[row[2]] for row in joined] == full
+        else:
+            # cluster_id comes before role in contributors
+            assert [
+                row[:3]
+                + dimension_rows[row[4]][:1]
+                + [row[3]]
+                + dimension_rows[row[4]][1:]
+                for row in joined
+            ] == full
+
+    # Known persons and organizations keep their keys
+    xml_to_sql(
+        TEST_XML, tmp_path / "again", data_format="tsv", streaming=True, normalize=ids
+    )
+    assert read("again", "persons") == []
+    assert read("again", "authorships") == read("first", "authorships")
+
+
+@pytest.mark.parametrize("processes", [None, 2])
+def test_xml_to_sql_stats(tmp_path, processes):
+    summaries = []
+    stats = Stats(callback=summaries.append, interval=0.0)
+    xml_to_sql(
+        TEST_XML,
+        tmp_path,
+        data_format="tsv",
+        processes=processes,
+        stats=stats,
+        stats_file=tmp_path / "stats.json",
+    )
+    summary = json.loads((tmp_path / "stats.json").read_text())
+    assert summary == json.loads(json.dumps(summaries[-1]))
+    assert len(summaries) > 1
+
+    assert summary["records"] == 50
+    assert 0 < summary["bytes"] <= TEST_XML.stat().st_size
+    for table_name, file_name, _, _ in tables:
+        lines = (tmp_path / (file_name + ".tsv")).read_text().splitlines()
+        assert summary["rows"][table_name] == len(lines)
+    assert {"read", "parse", "extract", "write"} <= set(summary["stages"])
+    assert "extract_authors" in summary["extractors"]
+    assert summary["records_per_second"] > 0
+
+
+def test_synthetic_corpus(tmp_path):
+    first = tmp_path / "first.xml"
+    n = write_corpus(first, 200_000, seed=3)
+    assert first.stat().st_size >= 200_000
+    write_corpus(tmp_path / "again.xml", 200_000, seed=3)
+    assert (tmp_path / "again.xml").read_bytes() == first.read_bytes()
+    write_corpus(tmp_path / "other.xml", 200_000, seed=4)
+    assert (tmp_path / "other.xml").read_bytes() != first.read_bytes()
+
+    rows = [
+        extract_record_rows(p_uid.first(REC).text, REC)
+        for REC in iter_rec_elements(first)
+    ]
+    assert len(rows) == n
+    assert len({r["publications"][0][0] for r in rows}) == n
+    for table_name in ["refs", "contributors", "institutions", "keywords", "funding"]:
+        assert any(r[table_name] for r in rows)
+    assert any(
+        r["publications"][0][h_publications.index("abstract")] != "NULL" for r in rows
+    )
+
+    generator = CorpusGenerator(seed=3, shape={"references": 0, "authors": 1})
+    for REC in map(ET.fromstring, generator.records(20)):
+        rows = extract_record_rows(p_uid.first(REC).text, REC)
+        assert rows["refs"] == []
+        assert len(rows["contributors"]) == 1
+
+
+@pytest.fixture(scope="module")
+def golden_corpora(tmp_path_factory):
+    return golden.write_test_corpora(tmp_path_factory.mktemp("corpora"))
+
+
+@pytest.mark.parametrize("engine", golden.available_engines())
+@pytest.mark.parametrize("corpus", ["sample", "synthetic"])
+def test_golden(golden_corpora, corpus, engine):
+    expected = golden.read_golden(current_dir / "golden" / corpus)
+    actual = golden.convert_rowsets(golden_corpora[corpus], **golden.engines[engine])
+    diffs = golden.diff_rowsets(expected, actual)
+    assert not diffs, golden.format_diff(diffs)
+
+
+def test_golden_coverage():
+    # Every table has rows in the goldens, so every extractor is compared
+    for table_name, rows in golden.read_golden(
+        current_dir / "golden" / "synthetic"
+    ).items():
+        assert rows, table_name
+
+
+def test_diff_rowsets():
+    expected = {"a": ["1\tx", "2\ty", "2\ty"], "b": ["3"]}
+    assert golden.diff_rowsets(expected, expected) == {}
+    actual = {"a": ["1\tx", "2\ty", "4\tz"], "b": ["3"]}
+    assert golden.diff_rowsets(expected, actual) == {"a": (["2\ty"], ["4\tz"])}
+    assert "a: 1 rows missing, 1 rows unexpected" in golden.format_diff(
+        golden.diff_rowsets(expected, actual)
+    )
+
+
+def _compress(path, compression):
+    data = TEST_XML.read_bytes()
+    if compression == "gzip":
+        path = path.with_suffix(".xml.gz")
+        path.write_bytes(gzip.compress(data))
+    elif compression == "bz2":
+        path = path.with_suffix(".xml.bz2")
+        path.write_bytes(bz2.compress(data))
+    elif compression == "zstd":
+        zstandard = pytest.importorskip("zstandard")
+        path = path.with_suffix(".xml.zst")
+        # Two frames, like concatenated files
+        half = len(data) // 2
+        compressor = zstandard.ZstdCompressor()
+        path.write_bytes(
+            compressor.compress(data[:half]) + compressor.compress(data[half:])
+        )
+    elif compression == "zip":
+        path = path.with_suffix(".zip")
+        with zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED) as archive:
+            archive.writestr("sample.xml", data)
+    return path
+
+
+@pytest.mark.parametrize("compression", ["gzip", "bz2", "zstd", "zip"])
+@pytest.mark.parametrize(
+    "options", [{}, {"reader": "iterparse"}, {"processes": 2, "chunk_size": 7}]
+)
+def test_compressed_input(tmp_path, compression, options):
+    sourcefile = _compress(tmp_path / "sample", compression)
+    (tmp_path / "out").mkdir()
+    xml_to_sql(TEST_XML, OUT_DIR)
+    xml_to_sql(sourcefile, tmp_path / "out", **options)
+    for sql_file in Path(OUT_DIR).glob("*.sql"):
+        assert (tmp_path / "out" / sql_file.name).read_text() == sql_file.read_text()
+
+
+def test_zip_members(tmp_path):
+    with zipfile.ZipFile(tmp_path / "delivery.zip", "w") as archive:
+        archive.write(TEST_XML, "a.xml")
+        archive.write(TEST_XML, "b.xml")
+        archive.writestr("readme.txt", "not a source")
+    sources = find_source_files(tmp_path)
+    assert sources == [
+        str(tmp_path / "delivery.zip" / "a.xml"),
+        str(tmp_path / "delivery.zip" / "b.xml"),
+    ]
+    with pytest.raises(ValueError):
+        open_source(tmp_path / "delivery.zip")
+
+    xml_to_sql(TEST_XML, OUT_DIR)
+    convert_files(tmp_path, tmp_path / "shards", processes=2, resume=True)
+    for sql_file in Path(OUT_DIR).glob("*.sql"):
+        for shard in ["a", "b"]:
+            assert (tmp_path / "shards" / shard / sql_file.name).read_text() == (
+                sql_file.read_text()
+            )
+
+
 if __name__ == "__main__":
     test_xml_to_sql()
@@ -1,4 +1,13 @@
 from .db_info import *
 from .conversion import *
+from .parallel import *
+from .database import *
+from .manifest import *
+from .store import *
+from .delta import *
+from .dedup import *
+from .normalize import *
+from .stats import *
+from .writers import *
 from .extract import *
 from .read_records import *
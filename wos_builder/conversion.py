@@ -1,234 +1,774 @@
 #!/usr/bin/env python
+import collections
+import contextlib
 import logging
-import xml.etree.cElementTree as ET
+import os
 
 import wos_builder.read_records as rr
 import wos_builder.extract as x
 import wos_builder.db_info as db_info
+from wos_builder.dedup import Deduplicator
+from wos_builder.delta import DeltaIndex
+from wos_builder.fused import extract_fused
+from wos_builder.manifest import Manifest
+from wos_builder.normalize import Normalizer
+from wos_builder.sources import is_plain, open_source, source_file
+from wos_builder.stats import Stats
+from wos_builder.writers import (
+    DEFAULT_MAX_BYTES,
+    DEFAULT_QUEUE_SIZE,
+    BackgroundWriter,
+    compressions,
+    formats,
+    output_name,
+    pyarrow,
+    to_rows,
+    zstandard,
+)
+from concurrent.futures import ProcessPoolExecutor
 
 
-def xml_to_sql(sourcefile, datadir):
+def _run(function, *args):
+    return function(*args)
+
+
+def extract_record(wos_id, REC, stats=None):
+    """Extracts the rows of every output table from a single REC element.
+
+    Returns a dict mapping each table name in db_info.tables to the list of
+    rows extracted for it. With a Stats object the time of every extract_*
+    function is added to it.
+    """
+    run = _run if stats is None else stats.call
+    rows = {table_name: [] for table_name, _, _, _ in db_info.tables}
+
+    Pub, Languages, Headings, Subheadings, Subjects = run(
+        x.extract_pub_info, wos_id, REC
+    )
+    rows["publications"].extend(Pub)
+    rows["languages"].extend(Languages)
+    rows["headings"].extend(Headings)
+    rows["subheadings"].extend(Subheadings)
+    rows["subjects"].extend(Subjects)
+
+    UnindexedPubs = run(x.extract_unindexed_publications, wos_id, REC)
+    rows["publications"].extend(UnindexedPubs)
+    rows["contributors"].extend(run(x.extract_unindexed_authors, UnindexedPubs))
+
+    rows["publishers"].extend(run(x.extract_publisher, wos_id, REC))
+    rows["contributors"].extend(run(x.extract_authors, wos_id, REC))
+
+    Institutions, Name_inst_relation = run(x.extract_addresses, wos_id, REC)
+    rows["institutions"].extend(Institutions)
+    rows["affiliations"].extend(Name_inst_relation)
+
+    rows["editions"].extend(run(x.extract_editions, wos_id, REC))
+    rows["refs"].extend(run(x.extract_references, wos_id, REC))
+
+    Ftext, Funding = run(x.extract_funding, wos_id, REC)
+    rows["fundingtext"].extend(Ftext)
+    rows["funding"].extend(Funding)
+
+    Conf, Sponsor = run(x.extract_conferences, wos_id, REC)
+    rows["conferences"].extend(Conf)
+    rows["confSponsors"].extend(Sponsor)
+
+    Keywords, Keywords_plus = run(x.extract_keywords, wos_id, REC)
+    rows["keywords"].extend(Keywords)
+    rows["keywords_plus"].extend(Keywords_plus)
+
+    return rows
+
+
+def extract_record_rows(wos_id, REC, stats=None):
+    """Like extract_record, but with rows as tuples ordered like the headers."""
+    rows = extract_record(wos_id, REC, stats)
+    run = _run if stats is None else stats.call
+    return {
+        table_name: run(to_rows, rows[table_name], header)
+        for table_name, _, header, _ in db_info.tables
+    }
+
+
+extractors = {"classic": extract_record_rows, "fused": extract_fused}
+
+
+def check_output(data_format, compression, compression_level=None):
+    """Raises ValueError or ImportError if the output cannot be written."""
+    if data_format not in formats:
+        raise ValueError("Unknown data format: {0}".format(data_format))
+    if compression not in compressions:
+        raise ValueError("Unknown compression: {0}".format(compression))
+    mode = formats[data_format].compression_mode
+    if compression is not None and mode is None:
+        raise ValueError(
+            "Compression is not supported for {0} output".format(data_format)
+        )
+    if compression is None and compression_level is not None:
+        raise ValueError("A compression level needs a compression")
+    if compression == "zstd" and mode == "stream" and zstandard is None:
+        raise ImportError("zstd compression requires the zstandard package")
+    if data_format == "parquet" and pyarrow is None:
+        raise ImportError("Parquet output requires the pyarrow package")
+
+
+def open_writer(
+    datadir,
+    table,
+    batch_size=None,
+    max_bytes=DEFAULT_MAX_BYTES,
+    data_format="sql",
+    compression=None,
+    compression_level=None,
+    append=False,
+    write_behind=False,
+):
+    """Opens a writer for one entry of db_info.tables in datadir.
+
+    data_format is a key of writers.formats. batch_size and max_bytes are
+    either used for every table or are dicts keyed by table name, where
+    missing tables get no limit. compression is a key of
+    writers.compressions, which all formats but tsv support, and
+    compression_level its level or None for the default. With append=True
+    an existing file is continued, which only appendable writers support.
+    With write_behind, True or the number of batches of rows to queue, the
+    writer runs in a BackgroundWriter.
+    """
+    check_output(data_format, compression, compression_level)
+    table_name, file_name, header, sql_header = table
+    options = {}
+    if compression is not None:
+        options["compression"] = compression
+        options["compression_level"] = compression_level
+    if append:
+        options["append"] = True
+    writer = formats[data_format](
+        header,
+        sql_header,
+        table_name,
+        "{0}/{1}".format(datadir, output_name(file_name, data_format, compression)),
+        batch_size=db_info.for_table(batch_size, table_name),
+        max_bytes=db_info.for_table(max_bytes, table_name),
+        **options,
+    )
+    if write_behind:
+        queue_size = DEFAULT_QUEUE_SIZE if write_behind is True else write_behind
+        return BackgroundWriter(writer, queue_size)
+    return writer
+
+
+def write_loader(datadir, loader_name="load.sql", tables=db_info.tables):
+    """Writes a script to datadir that creates the tables and loads TSV files.
+
+    The script uses the t_* DDL templates and one LOAD DATA LOCAL INFILE per
+    table with paths relative to datadir. Run it from there, for example with
+    mysql --local-infile=1 < load.sql.
+    """
+    with open("{0}/{1}".format(datadir, loader_name), "w") as f_handle:
+        for table_name, file_name, header, sql_header in tables:
+            f_handle.write(sql_header.format(table_name))
+            f_handle.write(
+                "LOAD DATA LOCAL INFILE '{0}'\n"
+                "IGNORE INTO TABLE {1}\n"
+                "CHARACTER SET utf8mb4\n"
+                "FIELDS TERMINATED BY '\\t' ESCAPED BY '\\\\'\n"
+                "LINES TERMINATED BY '\\n'\n"
+                "({2});\n".format(
+                    output_name(file_name, "tsv"), table_name, ", ".join(header)
+                )
+            )
+
+
+def _extract_element(REC, extractor, stats=None):
+    wos_id = None
+    try:
+        wos_id = x.p_uid.first(REC).text
+        if stats is None:
+            return extractors[extractor](wos_id, REC)
+        with stats.timer("extract"):
+            if extractor == "classic":
+                return extract_record_rows(wos_id, REC, stats)
+            return stats.call(extractors[extractor], wos_id, REC)
+    except ValueError as e:
+        print("[ERROR:{0}] Caught an exception : {1}".format(wos_id, e))
+        return None
+
+
+def _parse(record, backend, stats=None):
+    if stats is None:
+        return x.parse_record(record, backend)
+    with stats.timer("parse"):
+        return x.parse_record(record, backend)
+
+
+def _parse_record(record, backend, extractor, stats=None):
+    return _extract_element(_parse(record, backend, stats), extractor, stats)
+
+
+def _iter_elements(sourcefile, reader, backend, start=0, stats=None):
+    """Yields (end, REC) for each record, end is its end offset if known."""
+    if reader == "iterparse":
+        if start:
+            raise ValueError("The iterparse reader cannot start mid-file")
+        with contextlib.ExitStack() as stack:
+            data = sourcefile
+            if not is_plain(sourcefile):
+                data = stack.enter_context(open_source(sourcefile))
+            elements = x.iter_rec_elements(data, backend)
+            if stats is not None:
+                elements = stats.timed(elements, "parse")
+            for REC in elements:
+                yield None, REC
+    elif reader == "scan":
+        with open_source(sourcefile) as data:
+            data.seek(start)
+            records = rr.iter_records(data)
+            if stats is not None:
+                records = stats.timed(records, "read")
+            for offset, record in records:
+                if stats is not None:
+                    stats.bytes += len(record)
+                yield start + offset + len(record), _parse(record, backend, stats)
+    elif reader == "mmap":
+        if not is_plain(sourcefile):
+            raise ValueError("The mmap reader needs an uncompressed file")
+        records = rr.iter_mapped_records(sourcefile, start)
+        if stats is not None:
+            records = stats.timed(records, "read")
+        for offset, record in records:
+            if stats is not None:
+                stats.bytes += len(record)
+            yield offset + len(record), _parse(record, backend, stats)
+    else:
+        raise ValueError("Unknown reader: {0}".format(reader))
+
+
+def iter_tables(
+    sourcefile,
+    reader="scan",
+    backend="auto",
+    extractor="classic",
+    start=0,
+    offsets=False,
+    stats=None,
+):
+    """Yields the table rows extracted from each record in sourcefile.
+
+    With reader="scan" records are cut out of the file as bytes and parsed one
+    by one. reader="mmap" does the same for an uncompressed file without
+    copying the records, see iter_mapped_records. With reader="iterparse" the
+    whole file is parsed in a single pass and every REC element is extracted
+    as soon as its end tag is seen. backend is one of extract.backends, or
+    "auto" to use lxml if available. extractor names the function in
+    extractors that turns a REC into rows.
+
+    The scan and mmap readers can start at byte offset start instead of the
+    beginning of the file. With offsets=True it yields (end, rows) pairs,
+    where end is the offset right after the record. With a Stats object every
+    stage is timed.
+    """
+    backend = x.resolve_backend(backend)
+    if extractor not in extractors:
+        raise ValueError("Unknown extractor: {0}".format(extractor))
     count = 0
     logging.debug("Starting processing {0}".format(sourcefile))
 
-    Pubs_list = []
-    Lang_list = []
-    Head_list = []
-    Subh_list = []
-    Subj_list = []
-    Publ_list = []
-    Auth_list = []
-    Inst_list = []
-    NaIn_list = []
-    Edit_list = []
-    Refs_list = []
-    Ftxt_list = []
-    Fund_list = []
-    Keyw_list = []
-    Keyp_list = []
-    Conf_list = []
-    CoSp_list = []
-
-    with open(sourcefile, "r") as data:
-        while True:
-            count += 1
-            record = rr.get_record(data)
-
-            if not record:
-                logging.debug("Completed processing {0}".format(sourcefile))
-                print("Processed {0} records".format(count - 1))
-                break
+    for end, REC in _iter_elements(sourcefile, reader, backend, start, stats):
+        count += 1
+        if stats is not None:
+            stats.records += 1
 
-            try:
-                REC = ET.fromstring(record)
-                wos_id = list(REC.iterfind("UID"))[0].text
+        rows = _extract_element(REC, extractor, stats)
+        if rows is not None:
+            yield (end, rows) if offsets else rows
 
-                Pub, Languages, Headings, Subheadings, Subjects = x.extract_pub_info(
-                    wos_id, REC
+    if stats is not None and reader == "iterparse":
+        stats.bytes += os.path.getsize(source_file(sourcefile))
+    logging.debug("Completed processing {0}".format(sourcefile))
+    print("Processed {0} records".format(count))
+
+
+def _extract_records(records, backend, extractor, per_record=False, timed=False):
+    """Extracts the table rows of a list of records.
+
+    Returns the number of records, their rows, merged into one dict of
+    table rows or with per_record=True as a list of one dict per record, and
+    with timed=True a Stats object with the times of parsing and extraction.
+    """
+    stats = Stats() if timed else None
+    results = []
+    tables = {table_name: [] for table_name, _, _, _ in db_info.tables}
+    for record in records:
+        rows = _parse_record(record, backend, extractor, stats)
+        if rows is None:
+            continue
+        if per_record:
+            results.append(rows)
+        else:
+            for table_name, table_rows in rows.items():
+                tables[table_name].extend(table_rows)
+    return len(records), results if per_record else tables, stats
+
+
+def _extract_chunk(
+    sourcefile, spans, backend, extractor, per_record=False, timed=False
+):
+    """Extracts the table rows of the records at the given byte ranges."""
+    with rr.map_file(sourcefile) as buf, memoryview(buf) as view:
+        records = [view[start:end] for start, end in spans]
+        try:
+            return _extract_records(records, backend, extractor, per_record, timed)
+        finally:
+            for record in records:
+                record.release()
+
+
+def iter_tables_parallel(
+    sourcefile,
+    processes=None,
+    chunk_size=200,
+    backend="auto",
+    extractor="classic",
+    start=0,
+    offsets=False,
+    per_record=False,
+    stats=None,
+):
+    """Yields table rows of sourcefile extracted by a pool of worker processes.
+
+    The main process only scans the file for record boundaries, in a memory
+    map unless the file is compressed. Chunks of chunk_size records are parsed
+    and extracted in the workers, which map the records from the file
+    themselves unless it is compressed, and their rows are yielded in file
+    order, one dict of table rows per chunk or with per_record=True per
+    record. At most two chunks per worker are in flight at any time. start and
+    offsets work as for iter_tables, with end being the offset right after the
+    chunk for its last record and the start of the chunk otherwise. A Stats
+    object gets the times of the workers added.
+    """
+    if extractor not in extractors:
+        raise ValueError("Unknown extractor: {0}".format(extractor))
+    count = 0
+    processes = processes or os.cpu_count()
+    backend = x.resolve_backend(backend)
+    logging.debug(
+        "Starting processing {0} with {1} processes".format(sourcefile, processes)
+    )
+
+    plain = is_plain(sourcefile)
+    with contextlib.ExitStack() as stack:
+        pool = stack.enter_context(ProcessPoolExecutor(processes))
+        if plain:
+            records = rr.iter_mapped_records(sourcefile, start)
+        else:
+            data = stack.enter_context(open_source(sourcefile))
+            data.seek(start)
+            records = (
+                (start + offset, record) for offset, record in rr.iter_records(data)
+            )
+        pending = collections.deque()
+        if stats is not None:
+            records = stats.timed(records, "read")
+        for chunk in x.batched(records, chunk_size):
+            spans = [(offset, offset + len(record)) for offset, record in chunk]
+            timed = stats is not None
+            if plain:
+                future = pool.submit(
+                    _extract_chunk,
+                    sourcefile,
+                    spans,
+                    backend,
+                    extractor,
+                    per_record,
+                    timed,
+                )
+            else:
+                future = pool.submit(
+                    _extract_records,
+                    [record for _, record in chunk],
+                    backend,
+                    extractor,
+                    per_record,
+                    timed,
+                )
+            pending.append((spans[0][0], spans[-1][1], future))
+            if len(pending) >= 2 * processes:
+                count += yield from _chunk_results(
+                    pending.popleft(), offsets, per_record, stats
                 )
-                Pubs_list.extend(Pub)
-                Lang_list.extend(Languages)
-                Head_list.extend(Headings)
-                Subh_list.extend(Subheadings)
-                Subj_list.extend(Subjects)
 
-                UnindexedPubs = x.extract_unindexed_publications(wos_id, REC)
-                Pubs_list.extend(UnindexedPubs)
-                UnindexedAuthors = x.extract_unindexed_authors(UnindexedPubs)
-                Auth_list.extend(UnindexedAuthors)
+        while pending:
+            count += yield from _chunk_results(
+                pending.popleft(), offsets, per_record, stats
+            )
 
-                Publishers = x.extract_publisher(wos_id, REC)
-                Publ_list.extend(Publishers)
+    logging.debug("Completed processing {0}".format(sourcefile))
+    print("Processed {0} records".format(count))
 
-                Authors = x.extract_authors(wos_id, REC)
-                Auth_list.extend(Authors)
 
-                Institutions, Name_inst_relation = x.extract_addresses(wos_id, REC)
-                Inst_list.extend(Institutions)
-                NaIn_list.extend(Name_inst_relation)
+def _chunk_results(pending, offsets, per_record, stats=None):
+    """Yields the results of a chunk and returns its number of records."""
+    first, end, future = pending
+    if stats is None:
+        n, results, _ = future.result()
+    else:
+        with stats.timer("wait"):
+            n, results, worker_stats = future.result()
+        stats.merge(worker_stats)
+        stats.records += n
+        stats.bytes += end - first
+    if not per_record:
+        results = [results]
+    for i, rows in enumerate(results):
+        if offsets:
+            yield (end if i == len(results) - 1 else first), rows
+        else:
+            yield rows
+    return n
 
-                Editions = x.extract_editions(wos_id, REC)
-                Edit_list.extend(Editions)
 
-                References = x.extract_references(wos_id, REC)
-                Refs_list.extend(References)
+# Source bytes between two checkpoints of a resumable conversion
+DEFAULT_CHECKPOINT_BYTES = 64 * 1024 * 1024
 
-                Ftext, Funding = x.extract_funding(wos_id, REC)
-                Ftxt_list.extend(Ftext)
-                Fund_list.extend(Funding)
 
-                Conf, Sponsor = x.extract_conferences(wos_id, REC)
-                Conf_list.extend(Conf)
-                CoSp_list.extend(Sponsor)
+def xml_to_sql(
+    sourcefile,
+    datadir,
+    streaming=False,
+    batch_size=None,
+    max_bytes=DEFAULT_MAX_BYTES,
+    data_format="sql",
+    compression=None,
+    compression_level=None,
+    processes=None,
+    chunk_size=200,
+    reader="scan",
+    backend="auto",
+    extractor="classic",
+    resume=False,
+    checkpoint_bytes=DEFAULT_CHECKPOINT_BYTES,
+    delta_index=None,
+    dedup=None,
+    normalize=None,
+    write_behind=False,
+    stats=None,
+    stats_file=None,
+):
+    """Converts a Web of Science XML file into one output file per table.
 
-                Keywords, Keywords_plus = x.extract_keywords(wos_id, REC)
-                Keyw_list.extend(Keywords)
-                Keyp_list.extend(Keywords_plus)
+    Rows are written as INSERT statements of at most batch_size rows and
+    max_bytes bytes, see SqlWriter. Both can be given per table as a dict.
+    With data_format="tsv" every table is written as a tab-separated file
+    instead, together with a load.sql script that loads them with LOAD DATA.
+    data_format="jsonl" writes one JSON object per row and line.
+    data_format="parquet" writes a Parquet file per table with column types
+    from the DDL and row groups of batch_size rows, see ParquetWriter.
 
-            except ValueError as e:
-                print("[ERROR:{0}] Caught an exception : {1}".format(wos_id, e))
+    compression="gzip" or "zstd" compresses the sql and jsonl files in a
+    background thread and selects the codec of Parquet files, with
+    compression_level or the default level of the codec.
 
-    try:
-        logging.debug("Writing editions data to file...")
-        x.dump(
-            Edit_list,
-            db_info.h_editions,
-            db_info.t_editions,
-            "editions",
-            "{0}/editions.{1}".format(datadir, "sql"),
-        )
-        logging.debug("Writing funding text data to file...")
-        x.dump(
-            Ftxt_list,
-            db_info.h_fundingtexts,
-            db_info.t_fundingtexts,
-            "fundingtext",
-            "{0}/fundingtext.{1}".format(datadir, "sql"),
-        )
-        logging.debug("Writing funding data to file...")
-        x.dump(
-            Fund_list,
-            db_info.h_funding,
-            db_info.t_funding,
-            "funding",
-            "{0}/funding.{1}".format(datadir, "sql"),
-        )
-        logging.debug("Writing keywords data to file...")
-        x.dump(
-            Keyw_list,
-            db_info.h_keywords,
-            db_info.t_keywords,
-            "keywords",
-            "{0}/keywords.{1}".format(datadir, "sql"),
-        )
-        logging.debug("Writing keywords plus data to file...")
-        x.dump(
-            Keyp_list,
-            db_info.h_keywords_plus,
-            db_info.t_keywords_plus,
-            "keywords_plus",
-            "{0}/keywords_plus.{1}".format(datadir, "sql"),
-        )
-        logging.debug("Writing conferences data to file...")
-        x.dump(
-            Conf_list,
-            db_info.h_conferences,
-            db_info.t_conferences,
-            "conferences",
-            "{0}/conferences.{1}".format(datadir, "sql"),
-        )
-        logging.debug("Writing conference sponsors data to file...")
-        x.dump(
-            CoSp_list,
-            db_info.h_conf_sponsors,
-            db_info.t_conf_sponsors,
-            "confSponsors",
-            "{0}/confSponsors.{1}".format(datadir, "sql"),
-        )
-        logging.debug("Writing reference data to file...")
-        x.dump(
-            Refs_list,
-            db_info.h_references,
-            db_info.t_references,
-            "refs",
-            "{0}/references.{1}".format(datadir, "sql"),
-        )
-        logging.debug("Writing publication data to file...")
-        x.dump(
-            Pubs_list,
-            db_info.h_publications,
-            db_info.t_publications,
-            "publications",
-            "{0}/publications.{1}".format(datadir, "sql"),
-        )
-        logging.debug("Writing language data to file...")
-        x.dump(
-            Lang_list,
-            db_info.h_languages,
-            db_info.t_languages,
-            "languages",
-            "{0}/languages.{1}".format(datadir, "sql"),
-        )
-        logging.debug("Writing headings data to file...")
-        x.dump(
-            Head_list,
-            db_info.h_headings,
-            db_info.t_headings,
-            "headings",
-            "{0}/headings.{1}".format(datadir, "sql"),
-        )
-        logging.debug("Writing subheadings data to file...")
-        x.dump(
-            Subh_list,
-            db_info.h_subheadings,
-            db_info.t_subheadings,
-            "subheadings",
-            "{0}/subheadings.{1}".format(datadir, "sql"),
-        )
-        logging.debug("Writing subjects data to file...")
-        x.dump(
-            Subj_list,
-            db_info.h_subjects,
-            db_info.t_subjects,
-            "subjects",
-            "{0}/subjects.{1}".format(datadir, "sql"),
-        )
-        logging.debug("Writing publisher data to file...")
-        x.dump(
-            Publ_list,
-            db_info.h_publishers,
-            db_info.t_publishers,
-            "publishers",
-            "{0}/publishers.{1}".format(datadir, "sql"),
-        )
-        logging.debug("Writing contributor data to file...")
-        x.dump(
-            Auth_list,
-            db_info.h_contributors,
-            db_info.t_contributors,
-            "contributors",
-            "{0}/contributors.{1}".format(datadir, "sql"),
+    By default all rows are collected in memory and written once the whole
+    file has been read. With streaming=True the table files are opened up
+    front and every statement is written as soon as it is full, which keeps
+    memory usage constant regardless of the size of the input.
+
+    With write_behind=True every table is written by its own background
+    thread from a bounded queue, see BackgroundWriter, so that slow storage
+    like a network file system does not hold up the parsing. It can also be
+    the number of batches of rows queued per table. The output is the same.
+
+    If processes is given, records are parsed and extracted by that many
+    worker processes in chunks of chunk_size records. The output is the same
+    as for a single process. Otherwise reader selects how the file is read,
+    see iter_tables. backend selects the XML library used for parsing and
+    defaults to lxml if it is installed. Both backends give the same output.
+    extractor="fused" extracts all tables in a single pass over each record
+    instead of running every extract_* function separately.
+
+    With resume=True progress is tracked in a Manifest in datadir and a file
+    that was already converted with the same data_format and compression is
+    skipped. When streaming uncompressed sql, tsv or jsonl with the scan or
+    mmap reader or processes, a checkpoint is also saved after every
+    checkpoint_bytes bytes of input and an interrupted conversion continues
+    from the last one.
+
+    With delta_index, the path of a DeltaIndex, only records that are new or
+    changed since they were last written with the same index are output. The
+    rows of changed tables are deleted first, which needs data_format="sql".
+
+    With dedup=True rows of the tables in dedup.DEDUP_TABLES whose key was
+    already written are left out, see Deduplicator. dedup can also be the
+    path of a database of the keys, which finds duplicates across files and
+    runs as well. Deduplication cannot be combined with a delta_index.
+
+    With normalize, the path of an IdDictionary, contributors and
+    institutions are replaced by the tables in db_info.normalized_tables,
+    see Normalizer. It cannot be combined with a delta_index either.
+
+    With a Stats object the time of every stage, the throughput and the rows
+    per table are counted, see stats.py. With stats_file they are also
+    written there as JSON at the end, using a new Stats object if none is
+    given.
+    """
+    check_output(data_format, compression, compression_level)
+    if delta_index is not None and data_format != "sql":
+        raise ValueError("Delta updates are only supported for sql output")
+    if delta_index is not None and (dedup or normalize is not None):
+        raise ValueError(
+            "Deduplication and normalization cannot be combined with delta updates"
         )
-        logging.debug("Writing institutions data to file...")
-        x.dump(
-            Inst_list,
-            db_info.h_institutions,
-            db_info.t_institutions,
-            "institutions",
-            "{0}/institutions.{1}".format(datadir, "sql"),
+    manifest = Manifest(datadir) if resume else None
+    options = {"data_format": data_format, "compression": compression}
+    if compression_level is not None:
+        options["compression_level"] = compression_level
+    if delta_index is not None:
+        options["delta"] = True
+    if dedup:
+        options["dedup"] = True
+    if normalize is not None:
+        options["normalize"] = True
+    if manifest is not None and manifest.is_done(sourcefile, options):
+        print("Skipping {0}, it was already converted".format(sourcefile))
+        return
+
+    checkpoints = (
+        manifest is not None
+        and streaming
+        and formats[data_format].appendable
+        and compression is None
+        and (processes or reader in ("scan", "mmap"))
+    )
+    writer_options = {
+        "batch_size": batch_size,
+        "max_bytes": max_bytes,
+        "data_format": data_format,
+        "compression": compression,
+        "compression_level": compression_level,
+        "write_behind": write_behind,
+    }
+    start = 0
+    outputs = None
+    save_checkpoint = None
+    tables = db_info.tables if normalize is None else db_info.normalized_tables
+    index = None if delta_index is None else DeltaIndex(delta_index)
+    # State kept next to the output and committed with it
+    stores = [] if index is None else [index]
+    # Functions applied to the rows of every record, in order
+    steps = []
+    if normalize is not None:
+        normalizer = Normalizer(normalize)
+        stores.append(normalizer)
+        steps.append(("normalize", normalizer.normalize))
+    if dedup:
+        deduplicator = Deduplicator(None if dedup is True else dedup)
+        stores.append(deduplicator)
+        steps.append(("dedup", deduplicator.filter))
+    if stats_file is not None and stats is None:
+        stats = Stats()
+    if checkpoints:
+        resume_from = manifest.resume_point(sourcefile, options)
+        if resume_from is not None and _outputs_exist(datadir, resume_from["outputs"]):
+            start = resume_from["offset"]
+            outputs = resume_from["outputs"]
+            print("Resuming {0} at byte {1}".format(sourcefile, start))
+
+        def save_checkpoint(offset, outputs):
+            manifest.checkpoint(sourcefile, options, offset, outputs)
+            for store in stores:
+                store.commit()
+
+    if processes:
+        records = iter_tables_parallel(
+            sourcefile,
+            processes,
+            chunk_size,
+            backend,
+            extractor,
+            start,
+            checkpoints,
+            per_record=index is not None,
+            stats=stats,
         )
-        logging.debug("Writing affiliations data to file...")
-        x.dump(
-            NaIn_list,
-            db_info.h_name_inst,
-            db_info.t_name_inst,
-            "affiliations",
-            "{0}/affiliations.{1}".format(datadir, "sql"),
+    else:
+        records = iter_tables(
+            sourcefile, reader, backend, extractor, start, checkpoints, stats
         )
 
+    with contextlib.ExitStack() as stack:
+        for store in stores:
+            stack.enter_context(store)
+        for stage, step in steps:
+            if stats is not None:
+                step = stats.timed_call(step, stage)
+            records = _apply(records, step, checkpoints)
+        if stats is not None:
+            records = stats.source(_apply(records, stats.count, checkpoints))
+            stats.start()
+
+        if streaming:
+            _write_streaming(
+                records,
+                sourcefile,
+                datadir,
+                writer_options,
+                outputs,
+                save_checkpoint,
+                checkpoint_bytes,
+                index,
+                tables,
+                start,
+            )
+        else:
+            _write_collected(
+                records, sourcefile, datadir, writer_options, index, tables
+            )
+
+        if data_format == "tsv":
+            write_loader(datadir, tables=tables)
+        if manifest is not None:
+            manifest.finish(sourcefile, options)
+        for store in stores:
+            store.commit()
+
+    if stats is not None:
+        stats.stop()
+        if stats_file is not None:
+            stats.save(stats_file)
+    return
+
+
+def _apply(records, step, offsets=False):
+    """Passes the rows of every record through step."""
+    for record in records:
+        if offsets:
+            end, rows = record
+            yield end, step(rows)
+        else:
+            yield step(record)
+
+
+def _outputs_exist(datadir, outputs):
+    for file_name, size in outputs.items():
+        path = os.path.join(datadir, file_name)
+        if not os.path.exists(path) or os.path.getsize(path) < size:
+            return False
+    return True
+
+
+def _write_collected(
+    records, sourcefile, datadir, writer_options, index=None, tables=db_info.tables
+):
+    # Deletes and writes per table in the order of the records, as a record
+    # can replace one that came earlier in the same file
+    collected = {table_name: [("write", [])] for table_name, _, _, _ in tables}
+
+    def add(table_name, method, items):
+        steps = collected[table_name]
+        if steps[-1][0] != method:
+            steps.append((method, []))
+        steps[-1][1].extend(items)
+
+    for rows in records:
+        if index is not None:
+            record_deletes, rows = index.diff(rows)
+            for table_name, keys in record_deletes.items():
+                add(table_name, "delete", keys)
+        for table_name, table_rows in rows.items():
+            add(table_name, "write", table_rows)
+
+    try:
+        with contextlib.ExitStack() as stack:
+            # Background writers write all tables at the same time
+            for table in tables:
+                table_name = table[0]
+                logging.debug("Writing {0} data to file...".format(table_name))
+                writer = stack.enter_context(
+                    open_writer(datadir, table, **writer_options)
+                )
+                for method, items in collected[table_name]:
+                    getattr(writer, method)(items)
+
     except Exception:
-        print("[ERROR] Dumping failed for {0}".format(sourcefile))
-        logging.error("[ERROR] Dumping failed for {0}".format(sourcefile))
-        exit(-1)
+        _dump_failed(sourcefile)
+        raise
 
     return
+
+
+def _write_streaming(
+    records,
+    sourcefile,
+    datadir,
+    writer_options,
+    outputs=None,
+    save_checkpoint=None,
+    checkpoint_bytes=DEFAULT_CHECKPOINT_BYTES,
+    index=None,
+    tables=db_info.tables,
+    start=0,
+):
+    """Writes records as they come, see xml_to_sql.
+
+    writer_options are the keyword arguments of open_writer for every table.
+    If outputs maps the output files to their sizes at a checkpoint, they
+    are cut back to these sizes and continued. With save_checkpoint, records
+    are (end, rows) pairs and save_checkpoint(end, outputs) is called with
+    the current sizes whenever checkpoint_bytes of input have been written
+    since the last checkpoint, or since start, the offset of a resumed
+    conversion. With a DeltaIndex only the changes of every record are written.
+    """
+    with contextlib.ExitStack() as stack:
+        try:
+            if outputs is not None:
+                for file_name, size in outputs.items():
+                    os.truncate(os.path.join(datadir, file_name), size)
+            writers = {
+                table[0]: stack.enter_context(
+                    open_writer(
+                        datadir, table, append=outputs is not None, **writer_options
+                    )
+                )
+                for table in tables
+            }
+        except Exception:
+            _dump_failed(sourcefile)
+            raise
+
+        last_checkpoint = start
+        for rows in records:
+            if save_checkpoint is not None:
+                end, rows = rows
+            deletes = {}
+            if index is not None:
+                deletes, rows = index.diff(rows)
+            try:
+                for table_name, table_rows in rows.items():
+                    if table_name in deletes:
+                        writers[table_name].delete(deletes[table_name])
+                    writers[table_name].write(table_rows)
+
+                if (
+                    save_checkpoint is not None
+                    and end - last_checkpoint >= checkpoint_bytes
+                ):
+                    _checkpoint(writers, end, save_checkpoint)
+                    last_checkpoint = end
+            except Exception:
+                _dump_failed(sourcefile)
+                raise
+
+    return
+
+
+def _dump_failed(sourcefile):
+    print("[ERROR] Dumping failed for {0}".format(sourcefile))
+    logging.error("[ERROR] Dumping failed for {0}".format(sourcefile))
+
+
+def _checkpoint(writers, end, save_checkpoint):
+    outputs = {}
+    for writer in writers.values():
+        writer.flush()
+        outputs[os.path.basename(writer.file_name)] = os.path.getsize(writer.file_name)
+    save_checkpoint(end, outputs)
@@ -0,0 +1,255 @@
+#!/usr/bin/env python
+"""Loading of extracted rows straight into a database.
+
+Any DB-API 2 driver works. Tables are created from the t_* templates in
+db_info and rows are inserted with executemany by a few background threads,
+so parsing and database writes overlap.
+"""
+
+import functools
+import logging
+import queue
+import threading
+
+import wos_builder.db_info as db_info
+from wos_builder.conversion import iter_tables, iter_tables_parallel
+from wos_builder.db_info import column_types, for_table
+from wos_builder.writers import python_value
+
+try:
+    import pymysql
+except ImportError:
+    pymysql = None
+
+# Rows per executemany call if no batch_size is given
+DEFAULT_BATCH_SIZE = 1000
+
+# INSERT statement and parameter placeholder by SQL dialect
+dialects = {
+    "mysql": ("INSERT IGNORE", "%s"),
+    "sqlite": ("INSERT OR IGNORE", "?"),
+}
+
+
+def create_statement(sql_header, table_name):
+    """Returns the CREATE TABLE statement of a t_* DDL template.
+
+    The USE statement and comments of the template are left out, the
+    connection is expected to use the right database already.
+    """
+    ddl = sql_header.format(table_name)
+    return ddl[ddl.index("CREATE TABLE") : ddl.rindex(")") + 1]
+
+
+def mysql_connect(
+    host="localhost", port=3306, user=None, password=None, database="wos"
+):
+    """Returns a function that opens a connection to MySQL with pymysql."""
+    if pymysql is None:
+        raise ImportError("Loading into MySQL requires the pymysql package")
+    return functools.partial(
+        pymysql.connect,
+        host=host,
+        port=port,
+        user=user,
+        password=password,
+        database=database,
+        charset="utf8mb4",
+    )
+
+
+class ConnectionPool:
+    """A fixed number of connections, opened up front with connect()."""
+
+    def __init__(self, connect, size=4):
+        self.connections = [connect() for _ in range(size)]
+        self.idle = queue.Queue()
+        for connection in self.connections:
+            self.idle.put(connection)
+
+    def get(self):
+        """Takes a connection out of the pool, waiting for one if necessary."""
+        return self.idle.get()
+
+    def put(self, connection):
+        self.idle.put(connection)
+
+    def close(self):
+        for connection in self.connections:
+            connection.close()
+
+
+class DatabaseSink:
+    """Inserts the rows of all tables into a database in the background.
+
+    Rows of a table are collected into batches of batch_size rows, which are
+    handed to one of pool_size writer threads through a bounded queue of
+    queue_size batches. batch_size can be given per table as a dict, tables
+    without a size get DEFAULT_BATCH_SIZE. Every thread owns one connection of
+    the pool and writes its batches with executemany, committing after each. A
+    table is always written by the same thread, so its rows arrive in order.
+    Once the queue is full, write blocks until the database has caught up.
+
+    An error in a writer thread stops all further inserts and is raised by
+    the next call to write or close.
+    """
+
+    def __init__(
+        self,
+        connect,
+        dialect="mysql",
+        batch_size=DEFAULT_BATCH_SIZE,
+        pool_size=4,
+        queue_size=8,
+        create=True,
+    ):
+        insert, placeholder = dialects[dialect]
+        self.batch_sizes = {}
+        self.statements = {}
+        self.integers = {}
+        for table_name, _, header, sql_header in db_info.tables:
+            size = for_table(batch_size, table_name) or DEFAULT_BATCH_SIZE
+            if size < 1:
+                raise ValueError("batch_size must be at least one")
+            self.batch_sizes[table_name] = size
+            self.statements[table_name] = "{0} INTO {1} ({2}) VALUES ({3})".format(
+                insert,
+                table_name,
+                ", ".join(header),
+                ", ".join([placeholder] * len(header)),
+            )
+            types = column_types(sql_header)
+            self.integers[table_name] = [
+                types.get(column, "").startswith("int") for column in header
+            ]
+
+        self.pool = ConnectionPool(connect, pool_size)
+        if create:
+            try:
+                self.create_tables()
+            except Exception:
+                self.pool.close()
+                raise
+
+        self.pending = {table_name: [] for table_name in self.statements}
+        self.errors = []
+        self.queues = [queue.Queue(queue_size) for _ in range(pool_size)]
+        self.routes = {
+            table_name: self.queues[i % pool_size]
+            for i, table_name in enumerate(self.statements)
+        }
+        self.threads = [
+            threading.Thread(target=self._drain, args=(tasks,), daemon=True)
+            for tasks in self.queues
+        ]
+        for thread in self.threads:
+            thread.start()
+
+    def create_tables(self):
+        connection = self.pool.get()
+        try:
+            cursor = connection.cursor()
+            for table_name, _, _, sql_header in db_info.tables:
+                cursor.execute(create_statement(sql_header, table_name))
+            cursor.close()
+            connection.commit()
+        finally:
+            self.pool.put(connection)
+
+    def write(self, table_name, rows):
+        self._raise_errors()
+        pending = self.pending[table_name]
+        pending.extend(rows)
+        size = self.batch_sizes[table_name]
+        while len(pending) >= size:
+            self.routes[table_name].put((table_name, pending[:size]))
+            del pending[:size]
+
+    def flush(self):
+        for table_name, pending in self.pending.items():
+            if pending:
+                self.routes[table_name].put((table_name, pending[:]))
+                pending.clear()
+
+    def close(self):
+        if not self.threads:
+            return
+        try:
+            self.flush()
+        finally:
+            for tasks in self.queues:
+                tasks.put(None)
+            for thread in self.threads:
+                thread.join()
+            self.threads = []
+            self.pool.close()
+        self._raise_errors()
+
+    def _raise_errors(self):
+        if self.errors:
+            raise self.errors[0]
+
+    def _drain(self, tasks):
+        connection = self.pool.get()
+        try:
+            while (task := tasks.get()) is not None:
+                if self.errors:
+                    # Keep taking batches so that write never blocks forever
+                    continue
+                table_name, rows = task
+                integers = self.integers[table_name]
+                try:
+                    cursor = connection.cursor()
+                    cursor.executemany(
+                        self.statements[table_name],
+                        [tuple(map(python_value, row, integers)) for row in rows],
+                    )
+                    cursor.close()
+                    connection.commit()
+                except Exception as e:
+                    logging.error(
+                        "[ERROR] Inserting into {0} failed: {1}".format(table_name, e)
+                    )
+                    self.errors.append(e)
+        finally:
+            self.pool.put(connection)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def xml_to_db(
+    sourcefile,
+    connect,
+    dialect="mysql",
+    batch_size=DEFAULT_BATCH_SIZE,
+    pool_size=4,
+    queue_size=8,
+    processes=None,
+    chunk_size=200,
+    reader="scan",
+    backend="auto",
+    extractor="classic",
+):
+    """Loads a Web of Science XML file straight into a database.
+
+    connect is a function without arguments that returns a new DB-API 2
+    connection, for example from mysql_connect. dialect is a key of dialects.
+    The tables are created if they do not exist and rows are inserted while
+    the file is read, see DatabaseSink. The remaining arguments are the same
+    as for xml_to_sql.
+    """
+    if processes:
+        records = iter_tables_parallel(
+            sourcefile, processes, chunk_size, backend, extractor
+        )
+    else:
+        records = iter_tables(sourcefile, reader, backend, extractor)
+
+    with DatabaseSink(connect, dialect, batch_size, pool_size, queue_size) as sink:
+        for rows in records:
+            for table_name, table_rows in rows.items():
+                sink.write(table_name, table_rows)
@@ -1,5 +1,5 @@
 #!/usr/bin/env python
-
+import re
 
 h_publishers = [
     "wos_id",  # Primary key
@@ -321,6 +321,148 @@ CREATE TABLE IF NOT EXISTS {0} (
 );
 """
 
+h_organizations = [
+    "org_id",  # Primary key
+    "organization",
+    "suborganization",
+    "full_address",
+    "city",
+    "state",
+    "country",
+    "zip",
+]
+t_organizations = """
+USE wos;
+-- DROP TABLE IF EXISTS {0};
+CREATE TABLE IF NOT EXISTS {0} (
+    org_id           int unsigned PRIMARY KEY,
+    organization     varchar(200),
+    suborganization  varchar(200),
+    full_address     varchar(200),
+    city             varchar(50),
+    state            varchar(50),
+    country          varchar(50),
+    zip              varchar(20)
+);
+"""
+
+h_addresses = ["wos_id", "addr_num", "org_id"]
+t_addresses = """
+USE wos;
+-- DROP TABLE IF EXISTS {0};
+CREATE TABLE IF NOT EXISTS {0} (
+    wos_id           varchar(40),
+    addr_num         varchar(5),
+    org_id           int unsigned
+);
+"""
+
+h_persons = [
+    "person_id",  # Primary key
+    "cluster_id",
+    "orcid_id",
+    "orcid_id_tr",
+    "display_name",
+    "full_name",
+    "wos_standard",
+    "first_name",
+    "last_name",
+    "email_addr",
+]
+t_persons = """
+USE wos;
+-- DROP TABLE IF EXISTS {0};
+CREATE TABLE IF NOT EXISTS {0} (
+    person_id    int unsigned PRIMARY KEY,
+    cluster_id   varchar(10),
+    orcid_id     varchar(15),
+    orcid_id_tr  varchar(15),
+    display_name varchar(50),
+    full_name    varchar(50),
+    wos_standard varchar(50),
+    first_name   varchar(50),
+    last_name    varchar(50),
+    email_addr   varchar(50)
+);
+"""
+
+h_authorships = ["wos_id", "position", "reprint", "role", "person_id"]
+t_authorships = """
+USE wos;
+-- DROP TABLE IF EXISTS {0};
+CREATE TABLE IF NOT EXISTS {0} (
+    wos_id       varchar(40),
+    position     varchar(5),
+    reprint      varchar(5),
+    role         varchar(10),
+    person_id    int unsigned,
+    PRIMARY KEY (wos_id, position)
+);
+"""
+
+
+# Output tables in the order they are written: (table name, file name, header, DDL)
+tables = [
+    ("editions", "editions", h_editions, t_editions),
+    ("fundingtext", "fundingtext", h_fundingtexts, t_fundingtexts),
+    ("funding", "funding", h_funding, t_funding),
+    ("keywords", "keywords", h_keywords, t_keywords),
+    ("keywords_plus", "keywords_plus", h_keywords_plus, t_keywords_plus),
+    ("conferences", "conferences", h_conferences, t_conferences),
+    ("confSponsors", "confSponsors", h_conf_sponsors, t_conf_sponsors),
+    ("refs", "references", h_references, t_references),
+    ("publications", "publications", h_publications, t_publications),
+    ("languages", "languages", h_languages, t_languages),
+    ("headings", "headings", h_headings, t_headings),
+    ("subheadings", "subheadings", h_subheadings, t_subheadings),
+    ("subjects", "subjects", h_subjects, t_subjects),
+    ("publishers", "publishers", h_publishers, t_publishers),
+    ("contributors", "contributors", h_contributors, t_contributors),
+    ("institutions", "institutions", h_institutions, t_institutions),
+    ("affiliations", "affiliations", h_name_inst, t_name_inst),
+]
+
+# Tables of normalized output, where contributors and institutions are split
+# into fact tables and dimension tables with integer keys, see normalize.py
+normalized_tables = [
+    table for table in tables if table[0] not in ("contributors", "institutions")
+] + [
+    ("organizations", "organizations", h_organizations, t_organizations),
+    ("addresses", "addresses", h_addresses, t_addresses),
+    ("persons", "persons", h_persons, t_persons),
+    ("authorships", "authorships", h_authorships, t_authorships),
+]
+
+
+def column_types(sql_header):
+    """Returns a dict of column name to SQL type from a t_* DDL template."""
+    body = sql_header[sql_header.index("(") + 1 : sql_header.rindex(")")]
+    types = {}
+    for line in body.splitlines():
+        match = re.match(r"\s*(\w+)\s+(\w+(?:\(\d+\))?(?: unsigned)?)", line)
+        if match and match.group(1) != "PRIMARY":
+            types[match.group(1)] = match.group(2)
+    return types
+
+
+def for_table(value, table_name):
+    """Returns the option value for table_name.
+
+    value is either used for every table or is a dict keyed by table name,
+    where missing tables get None.
+    """
+    return value.get(table_name) if isinstance(value, dict) else value
+
+
+def primary_key(sql_header):
+    """Returns the primary key columns of a t_* DDL template, or []."""
+    body = sql_header[sql_header.index("(") + 1 : sql_header.rindex(")")]
+    match = re.search(r"PRIMARY KEY\s*\(([^)]*)\)", body)
+    if match:
+        return [column.strip() for column in match.group(1).split(",")]
+    match = re.search(r"^\s*(\w+)\s+[^,\n]*PRIMARY KEY", body, re.MULTILINE)
+    return [match.group(1)] if match else []
+
 
 if __name__ == "__main__":
     for table in [
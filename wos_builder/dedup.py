@@ -0,0 +1,100 @@
+#!/usr/bin/env python
+"""Removal of rows that were written before.
+
+The same cited work that is not in the Web of Science is extracted as an
+unindexed publication from every record that cites it, and records that
+appear in several files repeat their publisher and institutions. A
+Deduplicator drops such rows before they are written, instead of leaving
+them to INSERT IGNORE. Rows are identified by their primary key, or by all
+columns for tables without one.
+"""
+
+import hashlib
+
+import wos_builder.db_info as db_info
+from wos_builder.db_info import primary_key
+from wos_builder.store import SqliteStore
+
+# Tables that are deduplicated by default, with their normalized replacements
+DEDUP_TABLES = (
+    "publications",
+    "contributors",
+    "publishers",
+    "institutions",
+    "authorships",
+    "addresses",
+)
+
+# Keys held in memory, about 150 MB, before the oldest are forgotten
+DEFAULT_MAX_KEYS = 2_000_000
+
+# Bytes per key digest
+KEY_DIGEST_SIZE = 8
+
+
+def key_columns(tables=DEDUP_TABLES):
+    """Returns the positions of the key columns by table name."""
+    columns = {}
+    for table_name, _, header, sql_header in db_info.tables + db_info.normalized_tables:
+        if table_name in tables:
+            key = primary_key(sql_header) or header
+            columns[table_name] = [header.index(column) for column in key]
+    return columns
+
+
+class Deduplicator(SqliteStore):
+    """Filters out rows whose key was seen before.
+
+    Without a path, the digests of the keys are kept in memory. Once
+    max_keys digests are held, the older half is forgotten, so memory stays
+    bounded and only duplicates that are far apart get through. With path,
+    all digests are stored in a SQLite database there, which also finds
+    duplicates across runs. Like a DeltaIndex, additions only become
+    permanent with commit.
+    """
+
+    def __init__(self, path=None, tables=DEDUP_TABLES, max_keys=DEFAULT_MAX_KEYS):
+        self.columns = key_columns(tables)
+        self.max_keys = max_keys
+        self.recent = set()
+        self.older = set()
+        super().__init__(
+            path,
+            "CREATE TABLE IF NOT EXISTS seen (digest BLOB PRIMARY KEY) WITHOUT ROWID",
+        )
+
+    def filter(self, rows):
+        """Returns the rows of one record without those seen before."""
+        kept = {}
+        for table_name, table_rows in rows.items():
+            columns = self.columns.get(table_name)
+            if columns is None:
+                kept[table_name] = table_rows
+                continue
+            kept[table_name] = [
+                row
+                for row in table_rows
+                if self._is_new(table_name, tuple(row[i] for i in columns))
+            ]
+        return kept
+
+    def _is_new(self, table_name, key):
+        digest = hashlib.blake2b(
+            repr((table_name, key)).encode(), digest_size=KEY_DIGEST_SIZE
+        ).digest()
+        if self.db is not None:
+            return (
+                self.db.execute(
+                    "INSERT OR IGNORE INTO seen VALUES (?)", (digest,)
+                ).rowcount
+                == 1
+            )
+
+        digest = int.from_bytes(digest, "little")
+        if digest in self.recent or digest in self.older:
+            return False
+        if len(self.recent) >= self.max_keys // 2:
+            self.older = self.recent
+            self.recent = set()
+        self.recent.add(digest)
+        return True
@@ -0,0 +1,83 @@
+#!/usr/bin/env python
+"""Change detection against the records of previous loads.
+
+A DeltaIndex keeps one short digest per table for every record that was
+written before. Records are compared table by table and only the tables
+whose rows changed are written again, after deleting the old rows of the
+record. Unchanged records produce no output at all.
+"""
+
+import hashlib
+
+import wos_builder.db_info as db_info
+from wos_builder.store import SqliteStore
+
+# Bytes per table digest in the index
+DELTA_DIGEST_SIZE = 8
+
+
+def record_id(rows):
+    """Returns the wos_id of the record the rows were extracted from.
+
+    Both extractors put the publication of the record itself first.
+    """
+    return rows["publications"][0][0]
+
+
+def table_digests(rows):
+    """Returns the digests of the rows of every table, concatenated."""
+    return b"".join(
+        hashlib.blake2b(
+            repr(rows[table_name]).encode(), digest_size=DELTA_DIGEST_SIZE
+        ).digest()
+        for table_name, _, _, _ in db_info.tables
+    )
+
+
+class DeltaIndex(SqliteStore):
+    """An on-disk index of wos_id to the table digests of each record.
+
+    The index is a SQLite database at path, created if it does not exist.
+    Updates only become permanent with commit, so the index can be kept in
+    step with the output written so far.
+    """
+
+    def __init__(self, path):
+        super().__init__(
+            path,
+            "CREATE TABLE IF NOT EXISTS records "
+            "(wos_id TEXT PRIMARY KEY, digests BLOB NOT NULL) WITHOUT ROWID",
+        )
+
+    def diff(self, rows):
+        """Compares the rows of one record with the index and updates it.
+
+        Returns (deletes, changed). changed maps table names to the rows to
+        write, which are all rows of a new record and the rows of the
+        changed tables of a known record. deletes maps the changed tables of
+        a known record to the list of keys whose old rows must be deleted
+        before. Rows of unindexed publications cited by the record are not
+        deleted, as other records may cite them too.
+        """
+        wos_id = record_id(rows)
+        digests = table_digests(rows)
+        found = self.db.execute(
+            "SELECT digests FROM records WHERE wos_id = ?", (wos_id,)
+        ).fetchone()
+        if found is not None and found[0] == digests:
+            return {}, {}
+        self.db.execute(
+            "INSERT OR REPLACE INTO records VALUES (?, ?)", (wos_id, digests)
+        )
+        if found is None:
+            return {}, rows
+
+        deletes = {}
+        changed = {}
+        for i, (table_name, _, _, _) in enumerate(db_info.tables):
+            part = slice(i * DELTA_DIGEST_SIZE, (i + 1) * DELTA_DIGEST_SIZE)
+            # A different layout of the digests counts as a change everywhere
+            if found[0][part] != digests[part] or len(found[0]) != len(digests):
+                deletes[table_name] = [wos_id]
+                changed[table_name] = rows[table_name]
+        return deletes, changed
@@ -4,7 +4,13 @@ from itertools import islice
 
 import logging
 import xml.etree.cElementTree as ET
-import json
+
+from wos_builder.writers import DEFAULT_MAX_BYTES, formats, to_rows
+
+try:
+    from lxml import etree as lxml_etree
+except ImportError:
+    lxml_etree = None
 
 log_levels = {
     "DEBUG": logging.DEBUG,
@@ -14,6 +20,109 @@ log_levels = {
     "CRITICAL": logging.CRITICAL,
 }
 
+backends = ["etree", "lxml"]
+
+# Parser of single records with lxml, created once like the CompiledPaths
+_lxml_parser = (
+    None
+    if lxml_etree is None
+    else lxml_etree.XMLParser(remove_comments=True, remove_pis=True)
+)
+
+
+class CompiledPath:
+    """A path expression that is compiled once and evaluated on many records.
+
+    On lxml elements the path runs as a precompiled etree.XPath. On standard
+    library elements it falls back to findall/find with the same path.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        if lxml_etree is not None:
+            self._all = lxml_etree.XPath(path)
+            self._first = lxml_etree.XPath("({0})[1]".format(path))
+        else:
+            self._all = self._first = None
+
+    def findall(self, elem):
+        """Returns a list of all matching elements."""
+        if self._all is not None and isinstance(elem, lxml_etree._Element):
+            return self._all(elem)
+        return elem.findall(self.path)
+
+    def first(self, elem):
+        """Returns the first matching element, or None if there is none."""
+        if self._first is not None and isinstance(elem, lxml_etree._Element):
+            match = self._first(elem)
+            return match[0] if match else None
+        return elem.find(self.path)
+
+
+p_uid = CompiledPath("./UID")
+p_references = CompiledPath("./static_data/fullrecord_metadata/references/reference")
+p_reference_uids = CompiledPath(
+    "./static_data/fullrecord_metadata/references/reference/uid[1]"
+)
+p_editions = CompiledPath("./static_data/summary/EWUID/edition")
+p_addresses = CompiledPath("./static_data/fullrecord_metadata/addresses/address_name")
+p_address_spec = CompiledPath("./address_spec")
+p_address_names = CompiledPath("./names/name")
+p_names = CompiledPath("./static_data/summary/names")
+p_publishers = CompiledPath("./static_data/summary/publishers")
+p_conferences = CompiledPath("./static_data/summary/conferences/conference")
+p_conf_info = CompiledPath("./conf_infos/conf_info")
+p_conf_title = CompiledPath("./conf_titles/conf_title")
+p_conf_dates = CompiledPath("./conf_dates/conf_dates")
+p_conf_date = CompiledPath("./conf_dates/conf_date")
+p_conf_city = CompiledPath("./conf_locations/conf_location/conf_city")
+p_conf_state = CompiledPath("./conf_locations/conf_location/conf_state")
+p_conf_host = CompiledPath("./conf_locations/conf_location/conf_host")
+p_conf_sponsors = CompiledPath("./sponsors/sponsor")
+p_fund_text = CompiledPath("./static_data/fullrecord_metadata/fund_ack/fund_text")
+p_grants = CompiledPath("./static_data/fullrecord_metadata/fund_ack/grants/grant")
+p_grant_agency = CompiledPath("./grant_agency")
+p_grant_ids = CompiledPath("./grant_ids/grant_id")
+p_pub_info = CompiledPath("./static_data/summary/pub_info")
+p_page = CompiledPath("./static_data/summary/pub_info/page")
+p_titles = CompiledPath("./static_data/summary/titles/title")
+p_doctype = CompiledPath("./static_data/summary/doctypes/doctype")
+p_identifiers = CompiledPath("./dynamic_data/cluster_related/identifiers/identifier")
+p_languages = CompiledPath("./static_data/fullrecord_metadata/languages/language")
+p_headings = CompiledPath(
+    "./static_data/fullrecord_metadata/category_info/headings/heading"
+)
+p_subheadings = CompiledPath(
+    "./static_data/fullrecord_metadata/category_info/subheadings/subheading"
+)
+p_subjects = CompiledPath(
+    "./static_data/fullrecord_metadata/category_info/subjects/subject"
+)
+p_oases = CompiledPath("./dynamic_data/ic_related/oases/oas")
+p_abstract = CompiledPath(
+    "./static_data/fullrecord_metadata/abstracts/abstract/abstract_text/p"
+)
+p_keywords = CompiledPath("./static_data/fullrecord_metadata/keywords/keyword")
+p_keywords_plus = CompiledPath("./static_data/item/keywords_plus/keyword")
+
+
+def resolve_backend(backend="auto"):
+    """Returns the XML backend to use, "lxml" if it is installed for "auto"."""
+    if backend == "auto":
+        return "lxml" if lxml_etree is not None else "etree"
+    if backend not in backends:
+        raise ValueError("Unknown backend: {0}".format(backend))
+    if backend == "lxml" and lxml_etree is None:
+        raise ImportError("The lxml backend requires the lxml package")
+    return backend
+
+
+def parse_record(record, backend="etree"):
+    """Parses the text of a single record into an element of the backend."""
+    if backend == "lxml":
+        return lxml_etree.fromstring(record, _lxml_parser)
+    return ET.fromstring(record)
+
 
 def load_data(datafile):
     context = ET.iterparse(datafile, events=("start", "end"))
@@ -22,25 +131,45 @@ def load_data(datafile):
     return context
 
 
-# uid -> wos_id
-def extract_references(wos_id, elem):
-    references = []
-    for ref in list(
-        elem.iterfind("./static_data/fullrecord_metadata/references/reference")
-    ):
-        if ref.find("uid") is None:
-            continue
-        cur = {"wos_id": wos_id, "citedId": ref.find("uid").text}
+def iter_rec_elements(datafile, backend="etree"):
+    """Yields every REC element of datafile once it has been parsed completely.
 
-        references.append(cur)
+    The file is parsed incrementally with iterparse. Each REC is cleared as
+    soon as the consumer moves on to the next one, together with the
+    reference the root element holds to it, so memory use stays flat.
+    """
+    if backend == "lxml":
+        context = lxml_etree.iterparse(
+            datafile, events=("end",), tag="REC", remove_comments=True, remove_pis=True
+        )
+        for _, elem in context:
+            yield elem
+            elem.clear()
+            while elem.getprevious() is not None:
+                del elem.getparent()[0]
+        return
 
-    return references
+    context = ET.iterparse(datafile, events=("start", "end"))
+    _, root = next(context)
+    for event, elem in context:
+        if event == "end" and elem.tag == "REC":
+            yield elem
+            elem.clear()
+            root.clear()
+
+
+# uid -> wos_id
+def extract_references(wos_id, elem):
+    return [
+        {"wos_id": wos_id, "citedId": uid.text}
+        for uid in p_reference_uids.findall(elem)
+    ]
 
 
 def extract_editions(wos_id, elem):
     return [
         {"wos_id": wos_id, "edition": i.attrib["value"]}
-        for i in elem.iterfind("./static_data/summary/EWUID/edition")
+        for i in p_editions.findall(elem)
     ]
 
 
@@ -48,12 +177,10 @@ def extract_addresses(wos_id, elem):
     addresslist = []
     name_address_relation = []
 
-    for addresses in elem.iterfind(
-        "./static_data/fullrecord_metadata/addresses/address_name"
-    ):
+    for addresses in p_addresses.findall(elem):
         addr = {
             "wos_id": wos_id,
-            "addr_num": list(addresses.iterfind("./address_spec"))[0].attrib["addr_no"],
+            "addr_num": p_address_spec.first(addresses).attrib["addr_no"],
             "organization": "NULL",
         }
 
@@ -82,7 +209,7 @@ def extract_addresses(wos_id, elem):
                 temp.update(t)
                 addresslist.extend([temp])
 
-        for name in list(addresses.iterfind("./names/name")):
+        for name in p_address_names.findall(addresses):
             name_address_relation.extend(
                 [
                     {
@@ -98,7 +225,7 @@ def extract_addresses(wos_id, elem):
 def extract_authors(wos_id, elem):
     authors = []
 
-    for names in elem.iterfind("./static_data/summary/names"):
+    for names in p_names.findall(elem):
         for name in names:
             author = {
                 "wos_id": wos_id,
@@ -117,7 +244,7 @@ def extract_authors(wos_id, elem):
 def extract_publisher(wos_id, elem):
     publisher = {"wos_id": wos_id}
 
-    for publishers in elem.iterfind("./static_data/summary/publishers"):
+    for publishers in p_publishers.findall(elem):
         for item in publishers.iter():
             if item.tag in ["display_name", "full_name", "full_address", "city"]:
                 publisher[item.tag] = item.text
@@ -129,48 +256,40 @@ def extract_conferences(wos_id, elem):
     conferences = []
     sponsors = []
 
-    for conf in list(elem.iterfind("./static_data/summary/conferences/conference")):
+    for conf in p_conferences.findall(elem):
         conference = {"wos_id": wos_id}
         conference["conf_id"] = conf.attrib.get("conf_id", "NULL")
 
         try:
-            conference["info"] = list(conf.iterfind("./conf_infos/conf_info"))[0].text
+            conference["info"] = p_conf_info.first(conf).text
         except Exception:
             conference["info"] = "NULL"
         try:
-            conference["title"] = list(conf.iterfind("./conf_titles/conf_title"))[
-                0
-            ].text
+            conference["title"] = p_conf_title.first(conf).text
         except Exception:
             conference["title"] = "NULL"
         try:
-            conference["dates"] = list(conf.iterfind("./conf_dates/conf_dates"))[0].text
+            conference["dates"] = p_conf_dates.first(conf).text
         except Exception:
             conference["dates"] = "NULL"
         try:
-            conference.update(list(conf.iterfind("./conf_dates/conf_date"))[0].attrib)
+            conference.update(p_conf_date.first(conf).attrib)
         except Exception:
             pass
         try:
-            conference["conf_city"] = list(
-                conf.iterfind("./conf_locations/conf_location/conf_city")
-            )[0].text
+            conference["conf_city"] = p_conf_city.first(conf).text
         except Exception:
             conference["conf_city"] = "NULL"
         try:
-            conference["conf_state"] = list(
-                conf.iterfind("./conf_locations/conf_location/conf_state")
-            )[0].text
+            conference["conf_state"] = p_conf_state.first(conf).text
         except Exception:
             conference["conf_state"] = "NULL"
         try:
-            conference["conf_host"] = list(
-                conf.iterfind("./conf_locations/conf_location/conf_host")
-            )[0].text
+            conference["conf_host"] = p_conf_host.first(conf).text
         except Exception:
             conference["conf_host"] = "NULL"
 
-        for sponsor in list(conf.iterfind("./sponsors/sponsor")):
+        for sponsor in p_conf_sponsors.findall(conf):
             sponsors.extend(
                 [
                     {
@@ -188,23 +307,19 @@ def extract_conferences(wos_id, elem):
 def extract_funding(wos_id, elem):
     funding = []
     text = "NULL"
-    for t in list(
-        elem.iterfind("./static_data/fullrecord_metadata/fund_ack/fund_text")
-    ):
+    for t in p_fund_text.findall(elem):
         for para in t.iter():
             if text == "NULL":
                 text = ""
             text = text + str(para.text) + "\n"
 
-    for g in list(
-        elem.iterfind("./static_data/fullrecord_metadata/fund_ack/grants/grant")
-    ):
+    for g in p_grants.findall(elem):
         grant_agency = None
-        for agency in g.iterfind("./grant_agency"):
+        for agency in p_grant_agency.findall(g):
             grant_agency = agency.text
 
         grant_id_list = []
-        for grant_id in g.iterfind("./grant_ids/grant_id"):
+        for grant_id in p_grant_ids.findall(g):
             grant_id_list.extend([str(grant_id.text)])
 
         if not grant_id_list:
@@ -223,8 +338,8 @@ def extract_pub_info(wos_id, elem):
     pub = {"wos_id": wos_id}
 
     try:
-        pub.update(list(elem.iterfind("./static_data/summary/pub_info"))[0].attrib)
-        pub.update(list(elem.iterfind("./static_data/summary/pub_info/page"))[0].attrib)
+        pub.update(p_pub_info.first(elem).attrib)
+        pub.update(p_page.first(elem).attrib)
     except Exception as e:
         logging.error(
             "{0} Could not capture pub_info, Skipping document.".format(wos_id)
@@ -232,16 +347,14 @@ def extract_pub_info(wos_id, elem):
         raise
 
     # Get title, source, and source abbreviations
-    for i in elem.iterfind("./static_data/summary/titles/title"):
+    for i in p_titles.findall(elem):
         pub[str(i.attrib["type"])] = i.text
 
     pub["title"] = pub.get("item")
 
     # Get document type
     try:
-        pub["doc_type"] = list(elem.iterfind("./static_data/summary/doctypes/doctype"))[
-            0
-        ].text
+        pub["doc_type"] = p_doctype.first(elem).text
     except Exception:
         logging.warn(
             "{0} Could not capture doctype, setting to default NULL".format(wos_id)
@@ -249,39 +362,23 @@ def extract_pub_info(wos_id, elem):
         pub["doc_type"] = "NULL"
 
     # Add accession_no and issn
-    for item in list(
-        elem.iterfind("./dynamic_data/cluster_related/identifiers/identifier")
-    ):
+    for item in p_identifiers.findall(elem):
         pub[item.attrib["type"]] = item.attrib["value"]
 
     languages = []
-    for lang in list(
-        elem.iterfind("./static_data/fullrecord_metadata/languages/language")
-    ):
+    for lang in p_languages.findall(elem):
         languages.extend([{"wos_id": wos_id, "language": lang.text}])
     # Get categorical data
     headings = []
-    for x in list(
-        elem.iterfind(
-            "./static_data/fullrecord_metadata/category_info/headings/heading"
-        )
-    ):
+    for x in p_headings.findall(elem):
         headings.extend([{"wos_id": wos_id, "heading": x.text}])
 
     subheadings = []
-    for sub in list(
-        elem.iterfind(
-            "./static_data/fullrecord_metadata/category_info/subheadings/subheading"
-        )
-    ):
+    for sub in p_subheadings.findall(elem):
         subheadings.extend([{"wos_id": wos_id, "subheading": sub.text}])
 
     subjects = []
-    for sub in list(
-        elem.iterfind(
-            "./static_data/fullrecord_metadata/category_info/subjects/subject"
-        )
-    ):
+    for sub in p_subjects.findall(elem):
         subjects.extend(
             [
                 {
@@ -292,23 +389,17 @@ def extract_pub_info(wos_id, elem):
             ]
         )
 
-    for item in list(
-        elem.iterfind("./dynamic_data/cluster_related/identifiers/identifier")
-    ):
+    for item in p_identifiers.findall(elem):
         pub[item.attrib["type"]] = item.attrib["value"]
 
     # Find the oases type gold status
-    for item in list(elem.iterfind("./dynamic_data/ic_related/oases/oas")):
+    for item in p_oases.findall(elem):
         if item.text == "Yes" and item.attrib["type"] == "gold":
             pub["oases_type_gold"] = "Yes"
 
     # Add the abstract
     abstract_text = "NULL"
-    for ab in list(
-        elem.iterfind(
-            "./static_data/fullrecord_metadata/abstracts/abstract/abstract_text/p"
-        )
-    ):
+    for ab in p_abstract.findall(elem):
         if abstract_text == "NULL":
             abstract_text = ""
         abstract_text = abstract_text + "\n<p>" + ab.text + "</p>"
@@ -321,12 +412,10 @@ def extract_keywords(wos_id, elem):
     keywords = []
     keywordsplus = []
 
-    for keyword in list(
-        elem.iterfind("./static_data/fullrecord_metadata/keywords/keyword")
-    ):
+    for keyword in p_keywords.findall(elem):
         keywords.extend([{"wos_id": wos_id, "keyword": keyword.text}])
 
-    for keyword in list(elem.iterfind("./static_data/item/keywords_plus/keyword")):
+    for keyword in p_keywords_plus.findall(elem):
         keywordsplus.extend([{"wos_id": wos_id, "keyword": keyword.text}])
 
     return keywords, keywordsplus
@@ -350,7 +439,7 @@ def extract_unindexed_authors(unindexed_pubs):
 def extract_unindexed_publications(wos_id, elem):
     """Extracts info on unindexed publications from the references"""
     unindexed_pubs = []
-    for ref in elem.iterfind("./static_data/fullrecord_metadata/references/reference"):
+    for ref in p_references.findall(elem):
         uid = ref.find("uid")
         if uid is None:
             continue
@@ -388,37 +477,38 @@ def batched(iterable, n):
         yield batch
 
 
-def dump(data, header, sql_header, table_name, file_name, data_format="sql"):
-    batch_size = 1000
-
-    if data_format == "sql":
-        with open(file_name, "w") as f_handle:
-            f_handle.write(sql_header.format(table_name))
-            f_handle.write("\n")
-            for batch in batched(data, batch_size):
-                f_handle.write(
-                    "INSERT IGNORE INTO {0} ({1})\n".format(
-                        table_name, ", ".join(header)
-                    )
-                )
-                f_handle.write("VALUES\n")
-
-                for idx, row in enumerate(batch):
-                    f_handle.write("(")
-                    f_handle.write(
-                        ",".join([json.dumps(row.get(attr, "NULL")) for attr in header])
-                    )
-                    f_handle.write(")")
-                    if idx == len(batch) - 1:
-                        f_handle.write(";")
-                    else:
-                        f_handle.write(",")
-                    f_handle.write("\n")
-
-    elif data_format == "json":
-        datadict = {table_name: data}
-        with open(file_name, "wb") as f_handle:
-            json.dump(datadict, f_handle)
+def dump(
+    data,
+    header,
+    sql_header,
+    table_name,
+    file_name,
+    data_format="sql",
+    batch_size=None,
+    max_bytes=DEFAULT_MAX_BYTES,
+    compression=None,
+    compression_level=None,
+):
+    """Writes the rows in data to file_name with the writer for data_format.
+
+    data_format is a key of writers.formats. compression is "gzip" or "zstd"
+    for all formats but tsv, compression_level its level or None for the
+    default.
+    """
+    options = {}
+    if compression is not None:
+        options["compression"] = compression
+        options["compression_level"] = compression_level
+    with formats[data_format](
+        header,
+        sql_header,
+        table_name,
+        file_name,
+        batch_size=batch_size,
+        max_bytes=max_bytes,
+        **options,
+    ) as writer:
+        writer.write(to_rows(data, header))
     return
 
 
@@ -451,25 +541,19 @@ if __name__ == "__main__":
 
     logging.debug("Document processing starts")
 
-    context = load_data(args.sourcefile)
     total = 0
     bad = 0
-    for event, elem in context:
-        if event != "start":
-            continue
-        pub = {}
-        if elem.tag == "REC":
-            total += 1
-            try:
-                wos_id = list(elem.iterfind("UID"))[0].text
-
-                pub = extract_pub_info(wos_id, elem)
-                publisher = extract_publisher(wos_id, elem)
-                authors = extract_authors(wos_id, elem)
-
-            except Exception:
-                bad += 1
-        elem.clear()
+    for elem in iter_rec_elements(args.sourcefile):
+        total += 1
+        try:
+            wos_id = p_uid.first(elem).text
+
+            pub = extract_pub_info(wos_id, elem)
+            publisher = extract_publisher(wos_id, elem)
+            authors = extract_authors(wos_id, elem)
+
+        except Exception:
+            bad += 1
 
     logging.debug(
         "Document Complete:{0} with bad/total lines : {1}/{2}".format(
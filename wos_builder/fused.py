@@ -0,0 +1,421 @@
+#!/usr/bin/env python
+"""Single-traversal extraction of all tables from a REC element.
+
+extract_fused walks the children of a record once and hands every element to
+the handler registered for its tag, instead of running one path query per
+table from the root. It produces the same rows as the extract_* functions in
+wos_builder.extract, which remain the reference implementation, but as
+tuples ordered like the db_info headers instead of dicts.
+"""
+
+import logging
+
+import wos_builder.db_info as db_info
+from wos_builder.writers import dict_row
+
+# Fields of an unindexed publication and the reference child they come from
+pub_to_ref = {
+    "doi": "doi",
+    "author": "citedAuthor",
+    "title": "citedTitle",
+    "source": "citedWork",
+    "pubyear": "year",
+    "vol": "volumne",
+    "begin": "page",
+}
+
+
+class _Record:
+    """Collects the pieces of one record while its tree is traversed."""
+
+    def __init__(self, wos_id):
+        self.wos_id = wos_id
+        self.rows = {table_name: [] for table_name, _, _, _ in db_info.tables}
+        self.pub_info = None
+        self.page = None
+        self.titles = []
+        self.doctype = None
+        self.identifiers = []
+        self.oases_gold = False
+        self.abstract = []
+        self.authors = []
+        self.unindexed_pubs = []
+        self.fund_text = None
+        self.publisher = {"wos_id": wos_id}
+
+
+def _editions(rec, elem):
+    for edition in elem:
+        if edition.tag == "edition":
+            rec.rows["editions"].append((rec.wos_id, edition.attrib["value"]))
+
+
+def _pub_info(rec, elem):
+    if rec.pub_info is None:
+        rec.pub_info = elem
+    if rec.page is None:
+        for page in elem:
+            if page.tag == "page":
+                rec.page = page
+                break
+
+
+def _titles(rec, elem):
+    rec.titles.extend(title for title in elem if title.tag == "title")
+
+
+def _names(rec, elem):
+    wos_id = rec.wos_id
+    for name in elem:
+        author = {
+            "wos_id": wos_id,
+            "position": name.attrib.get("seq_no", "NULL"),
+            "reprint": name.attrib.get("reprint", "NULL"),
+            "cluster_id": name.attrib.get("dais_id", "NULL"),
+            "role": name.attrib.get("role", "NULL"),
+        }
+        for item in name.iter():
+            author[str(item.tag)] = str(item.text)
+        rec.authors.append(dict_row(author, db_info.h_contributors))
+
+
+def _doctypes(rec, elem):
+    if rec.doctype is None:
+        for doctype in elem:
+            if doctype.tag == "doctype":
+                rec.doctype = doctype
+                break
+
+
+def _first(elem, *tags):
+    """Returns the first element at elem/tags[0]/tags[1]/... in document order."""
+    if not tags:
+        return elem
+    for child in elem:
+        if child.tag == tags[0]:
+            found = _first(child, *tags[1:])
+            if found is not None:
+                return found
+    return None
+
+
+def _first_text(elem, *tags):
+    found = _first(elem, *tags)
+    return "NULL" if found is None else found.text
+
+
+def _conferences(rec, elem):
+    wos_id = rec.wos_id
+    for conf in elem:
+        if conf.tag != "conference":
+            continue
+        conference = {"wos_id": wos_id}
+        conference["conf_id"] = conf.attrib.get("conf_id", "NULL")
+        conference["info"] = _first_text(conf, "conf_infos", "conf_info")
+        conference["title"] = _first_text(conf, "conf_titles", "conf_title")
+        conference["dates"] = _first_text(conf, "conf_dates", "conf_dates")
+        date = _first(conf, "conf_dates", "conf_date")
+        if date is not None:
+            conference.update(date.attrib)
+        for field in ["conf_city", "conf_state", "conf_host"]:
+            conference[field] = _first_text(
+                conf, "conf_locations", "conf_location", field
+            )
+
+        for sponsors in conf:
+            if sponsors.tag != "sponsors":
+                continue
+            for sponsor in sponsors:
+                if sponsor.tag == "sponsor":
+                    rec.rows["confSponsors"].append(
+                        (wos_id, conference["conf_id"], sponsor.text)
+                    )
+
+        rec.rows["conferences"].append(dict_row(conference, db_info.h_conferences))
+
+
+def _publishers(rec, elem):
+    for item in elem.iter():
+        if item.tag in ["display_name", "full_name", "full_address", "city"]:
+            rec.publisher[item.tag] = item.text
+
+
+def _languages(rec, elem):
+    for lang in elem:
+        if lang.tag == "language":
+            rec.rows["languages"].append((rec.wos_id, lang.text))
+
+
+def _category_info(rec, elem):
+    wos_id = rec.wos_id
+    for group in elem:
+        if group.tag == "headings":
+            for x in group:
+                if x.tag == "heading":
+                    rec.rows["headings"].append((wos_id, x.text))
+        elif group.tag == "subheadings":
+            for sub in group:
+                if sub.tag == "subheading":
+                    rec.rows["subheadings"].append((wos_id, sub.text))
+        elif group.tag == "subjects":
+            for sub in group:
+                if sub.tag == "subject":
+                    rec.rows["subjects"].append(
+                        (wos_id, sub.text, sub.attrib["ascatype"])
+                    )
+
+
+def _addresses(rec, elem):
+    wos_id = rec.wos_id
+    for addresses in elem:
+        if addresses.tag != "address_name":
+            continue
+        spec = None
+        for child in addresses:
+            if child.tag == "address_spec":
+                spec = child
+                break
+        addr = {
+            "wos_id": wos_id,
+            "addr_num": spec.attrib["addr_no"],
+            "organization": "NULL",
+        }
+
+        orgs = []
+        suborgs = []
+        for item in addresses.iter():
+            if item.tag in ["full_address", "city", "state", "country", "zip"]:
+                addr[str(item.tag)] = str(item.text)
+            elif item.tag == "organization":
+                orgs.append(item.text)
+            elif item.tag == "suborganization":
+                suborgs.append(item.text)
+
+        for org in orgs or ["NULL"]:
+            for suborg in suborgs or ["NULL"]:
+                addr["organization"] = org
+                addr["suborganization"] = suborg
+                rec.rows["institutions"].append(dict_row(addr, db_info.h_institutions))
+
+        for names in addresses:
+            if names.tag != "names":
+                continue
+            for name in names:
+                if name.tag == "name":
+                    rec.rows["affiliations"].append(
+                        (wos_id, name.attrib["seq_no"], name.attrib["addr_no"])
+                    )
+
+
+def _references(rec, elem):
+    wos_id = rec.wos_id
+    for ref in elem:
+        if ref.tag != "reference":
+            continue
+        children = {}
+        for child in ref:
+            children.setdefault(child.tag, child)
+        uid = children.get("uid")
+        if uid is None:
+            continue
+        uid = uid.text
+        rec.rows["refs"].append((wos_id, uid))
+
+        # An unindexed publication's UID does not start with WOS
+        if not uid.startswith("WOS"):
+            pub = {"wos_id": uid}
+            for pub_field, ref_field in pub_to_ref.items():
+                if (child := children.get(ref_field)) is not None:
+                    pub[pub_field] = child.text
+            rec.unindexed_pubs.append(pub)
+
+
+def _fund_ack(rec, elem):
+    wos_id = rec.wos_id
+    for child in elem:
+        if child.tag == "fund_text":
+            for para in child.iter():
+                if rec.fund_text is None:
+                    rec.fund_text = ""
+                rec.fund_text = rec.fund_text + str(para.text) + "\n"
+        elif child.tag == "grants":
+            for g in child:
+                if g.tag != "grant":
+                    continue
+                grant_agency = None
+                grant_id_list = []
+                for item in g:
+                    if item.tag == "grant_agency":
+                        grant_agency = item.text
+                    elif item.tag == "grant_ids":
+                        grant_id_list.extend(
+                            str(grant_id.text)
+                            for grant_id in item
+                            if grant_id.tag == "grant_id"
+                        )
+                for grant_id in grant_id_list or ["NULL"]:
+                    rec.rows["funding"].append((wos_id, grant_agency, grant_id))
+
+
+def _keywords(rec, elem, table_name="keywords"):
+    for keyword in elem:
+        if keyword.tag == "keyword":
+            rec.rows[table_name].append((rec.wos_id, keyword.text))
+
+
+def _abstracts(rec, elem):
+    for abstract in elem:
+        if abstract.tag != "abstract":
+            continue
+        for abstract_text in abstract:
+            if abstract_text.tag != "abstract_text":
+                continue
+            rec.abstract.extend(p for p in abstract_text if p.tag == "p")
+
+
+def _keywords_plus(rec, elem):
+    _keywords(rec, elem, "keywords_plus")
+
+
+def _cluster_related(rec, elem):
+    for identifiers in elem:
+        if identifiers.tag == "identifiers":
+            rec.identifiers.extend(
+                item for item in identifiers if item.tag == "identifier"
+            )
+
+
+def _ic_related(rec, elem):
+    for oases in elem:
+        if oases.tag != "oases":
+            continue
+        for item in oases:
+            if item.tag != "oas":
+                continue
+            if item.text == "Yes" and item.attrib["type"] == "gold":
+                rec.oases_gold = True
+
+
+summary_handlers = {
+    "EWUID": _editions,
+    "pub_info": _pub_info,
+    "titles": _titles,
+    "names": _names,
+    "doctypes": _doctypes,
+    "conferences": _conferences,
+    "publishers": _publishers,
+}
+
+fullrecord_handlers = {
+    "languages": _languages,
+    "category_info": _category_info,
+    "addresses": _addresses,
+    "references": _references,
+    "fund_ack": _fund_ack,
+    "keywords": _keywords,
+    "abstracts": _abstracts,
+}
+
+dynamic_handlers = {
+    "cluster_related": _cluster_related,
+    "ic_related": _ic_related,
+}
+
+static_handlers = {
+    "summary": summary_handlers,
+    "fullrecord_metadata": fullrecord_handlers,
+    "item": {"keywords_plus": _keywords_plus},
+}
+
+
+def _dispatch(rec, elem, handlers):
+    for child in elem:
+        handler = handlers.get(child.tag)
+        if handler is not None:
+            handler(rec, child)
+
+
+def _publication(rec):
+    wos_id = rec.wos_id
+    pub = {"wos_id": wos_id}
+
+    try:
+        pub.update(rec.pub_info.attrib)
+        pub.update(rec.page.attrib)
+    except Exception:
+        logging.error(
+            "{0} Could not capture pub_info, Skipping document.".format(wos_id)
+        )
+        raise
+
+    for i in rec.titles:
+        pub[str(i.attrib["type"])] = i.text
+
+    pub["title"] = pub.get("item")
+
+    if rec.doctype is not None:
+        pub["doc_type"] = rec.doctype.text
+    else:
+        logging.warning(
+            "{0} Could not capture doctype, setting to default NULL".format(wos_id)
+        )
+        pub["doc_type"] = "NULL"
+
+    for item in rec.identifiers:
+        pub[item.attrib["type"]] = item.attrib["value"]
+
+    if rec.oases_gold:
+        pub["oases_type_gold"] = "Yes"
+
+    abstract_text = "NULL"
+    for ab in rec.abstract:
+        if abstract_text == "NULL":
+            abstract_text = ""
+        abstract_text = abstract_text + "\n<p>" + ab.text + "</p>"
+    pub["abstract"] = abstract_text
+
+    return dict_row(pub, db_info.h_publications)
+
+
+def extract_fused(wos_id, elem):
+    """Extracts the rows of every output table in one pass over a REC element.
+
+    Returns a dict mapping each table name in db_info.tables to its rows, in
+    the same order as conversion.extract_record. Every row is a tuple with
+    one value per column of the table's db_info header.
+    """
+    rec = _Record(wos_id)
+
+    for section in elem:
+        if section.tag == "static_data":
+            for part in section:
+                handlers = static_handlers.get(part.tag)
+                if handlers is not None:
+                    _dispatch(rec, part, handlers)
+        elif section.tag == "dynamic_data":
+            _dispatch(rec, section, dynamic_handlers)
+
+    rows = rec.rows
+    rows["publications"].append(_publication(rec))
+    rows["publications"].extend(
+        dict_row(pub, db_info.h_publications) for pub in rec.unindexed_pubs
+    )
+
+    for pub in rec.unindexed_pubs:
+        if "author" not in pub:
+            continue
+        author = {
+            "wos_id": pub["wos_id"],
+            "role": "author",
+            "display_name": pub["author"],
+            "full_name": pub["author"],
+        }
+        rows["contributors"].append(dict_row(author, db_info.h_contributors))
+    rows["contributors"].extend(rec.authors)
+
+    rows["publishers"].append(dict_row(rec.publisher, db_info.h_publishers))
+
+    if rec.fund_text is not None:
+        rows["fundingtext"].append((wos_id, rec.fund_text))
+
+    return rows
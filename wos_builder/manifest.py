@@ -0,0 +1,111 @@
+#!/usr/bin/env python
+"""Bookkeeping of finished and partially converted source files.
+
+A Manifest is stored as JSON in the output folder of xml_to_sql. It records
+the path, size, modification time and content hash of every source file that
+was converted into the folder, or of its archive for zip members, together
+with the output options used. Files that are still being converted carry a
+checkpoint instead: the byte offset in the source file up to which all
+records have been written and the size of every output file at that point.
+"""
+
+import hashlib
+import json
+import os
+
+from wos_builder.sources import source_file
+
+MANIFEST_NAME = "manifest.json"
+
+
+def file_hash(path, block_size=1 << 24):
+    """Returns the BLAKE2b hash of the contents of a file as hex string."""
+    digest = hashlib.blake2b()
+    with open(path, "rb") as f_handle:
+        while block := f_handle.read(block_size):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def file_state(path):
+    """Returns the path, size and modification time of a file as a dict.
+
+    For a member of a zip archive these are the size and time of the archive.
+    """
+    stat = os.stat(source_file(path))
+    return {
+        "path": os.path.abspath(path),
+        "size": stat.st_size,
+        "mtime": stat.st_mtime_ns,
+    }
+
+
+class Manifest:
+    """The manifest in datadir, created empty if there is none yet.
+
+    Every change is saved right away. The file is replaced atomically, so a
+    crash leaves either the old or the new version behind.
+    """
+
+    def __init__(self, datadir):
+        self.path = os.path.join(datadir, MANIFEST_NAME)
+        self.files = {}
+        if os.path.exists(self.path):
+            with open(self.path) as f_handle:
+                self.files = json.load(f_handle)["files"]
+
+    def save(self):
+        tmp = self.path + ".tmp"
+        with open(tmp, "w") as f_handle:
+            json.dump({"files": self.files}, f_handle, indent=1)
+        os.replace(tmp, self.path)
+
+    def _entry(self, sourcefile, options):
+        """Returns the entry of sourcefile if it still matches file and options."""
+        entry = self.files.get(os.path.abspath(sourcefile))
+        if entry is None or entry["options"] != options:
+            return None
+        state = file_state(sourcefile)
+        if entry["size"] != state["size"]:
+            return None
+        if entry["mtime"] != state["mtime"]:
+            # Touched, but maybe not changed. Only finished files have a hash.
+            if entry.get("hash") != file_hash(source_file(sourcefile)):
+                return None
+            entry["mtime"] = state["mtime"]
+            self.save()
+        return entry
+
+    def is_done(self, sourcefile, options):
+        """Returns True if sourcefile was converted completely with options."""
+        entry = self._entry(sourcefile, options)
+        return entry is not None and entry["status"] == "done"
+
+    def resume_point(self, sourcefile, options):
+        """Returns the last checkpoint of sourcefile, or None to start over.
+
+        A checkpoint is a dict with the source "offset" up to which all
+        records were written and the byte size of all "outputs" by file name.
+        """
+        entry = self._entry(sourcefile, options)
+        if entry is None or entry["status"] != "partial":
+            return None
+        return entry["checkpoint"]
+
+    def checkpoint(self, sourcefile, options, offset, outputs):
+        entry = file_state(sourcefile)
+        entry.update(
+            status="partial",
+            options=options,
+            checkpoint={"offset": offset, "outputs": outputs},
+        )
+        self.files[entry["path"]] = entry
+        self.save()
+
+    def finish(self, sourcefile, options):
+        entry = file_state(sourcefile)
+        entry.update(
+            status="done", options=options, hash=file_hash(source_file(sourcefile))
+        )
+        self.files[entry["path"]] = entry
+        self.save()
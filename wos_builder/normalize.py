@@ -0,0 +1,122 @@
+#!/usr/bin/env python
+"""Normalized output of contributors and institutions.
+
+Both tables repeat the names and addresses of the same people and
+organizations in every record. In normalized output every distinct
+organization and person is written once to a dimension table with an
+integer key, and the records refer to it from a narrow fact table:
+
+    institutions -> addresses (wos_id, addr_num, org_id) + organizations
+    contributors -> authorships (wos_id, position, ...) + persons
+
+The keys come from an IdDictionary, which is kept on disk so that the same
+organization or person gets the same key in every run.
+"""
+
+import hashlib
+
+import wos_builder.db_info as db_info
+from wos_builder.store import SqliteStore
+
+# Table replaced, fact table and dimension table of each normalized table
+normalized = [
+    ("institutions", "addresses", "organizations"),
+    ("contributors", "authorships", "persons"),
+]
+
+# Bytes per digest of the values of an organization or person
+ID_DIGEST_SIZE = 16
+
+
+class IdDictionary(SqliteStore):
+    """An on-disk dictionary that hands out integer keys for values.
+
+    The dictionary is a SQLite database at path, created if it does not
+    exist. Keys are counted from 1 per dimension. Like a DeltaIndex, new
+    keys only become permanent with commit.
+    """
+
+    def __init__(self, path):
+        super().__init__(
+            path,
+            "CREATE TABLE IF NOT EXISTS ids (dimension TEXT, digest BLOB, "
+            "id INTEGER NOT NULL, PRIMARY KEY (dimension, digest)) WITHOUT ROWID",
+        )
+        self.next_ids = {}
+
+    def get(self, dimension, values):
+        """Returns (key, new) for a tuple of values in dimension.
+
+        new is True if values were not in the dictionary before.
+        """
+        digest = hashlib.blake2b(
+            repr(values).encode(), digest_size=ID_DIGEST_SIZE
+        ).digest()
+        found = self.db.execute(
+            "SELECT id FROM ids WHERE dimension = ? AND digest = ?",
+            (dimension, digest),
+        ).fetchone()
+        if found is not None:
+            return found[0], False
+
+        if dimension not in self.next_ids:
+            last = self.db.execute(
+                "SELECT max(id) FROM ids WHERE dimension = ?", (dimension,)
+            ).fetchone()[0]
+            self.next_ids[dimension] = (last or 0) + 1
+        key = self.next_ids[dimension]
+        self.next_ids[dimension] += 1
+        self.db.execute("INSERT INTO ids VALUES (?, ?, ?)", (dimension, digest, key))
+        return key, True
+
+
+def _layout():
+    headers = {
+        table_name: header
+        for table_name, _, header, _ in db_info.tables + db_info.normalized_tables
+    }
+    layout = []
+    for source, fact, dimension in normalized:
+        source_header = headers[source]
+        key = headers[dimension][0]
+        layout.append(
+            (
+                source,
+                fact,
+                dimension,
+                [source_header.index(column) for column in headers[dimension][1:]],
+                # None marks the position of the key in the fact rows
+                [
+                    None if column == key else source_header.index(column)
+                    for column in headers[fact]
+                ],
+            )
+        )
+    return layout
+
+
+class Normalizer(IdDictionary):
+    """Splits the rows of a record into normalized tables with an IdDictionary.
+
+    The rows of a dimension table are only returned when the dictionary
+    hands out a new key, so every organization and person is written once.
+    """
+
+    def __init__(self, path):
+        super().__init__(path)
+        self.layout = _layout()
+
+    def normalize(self, rows):
+        rows = dict(rows)
+        for source, fact, dimension, values, columns in self.layout:
+            fact_rows = []
+            dimension_rows = []
+            for row in rows.pop(source):
+                value = tuple(row[i] for i in values)
+                key, new = self.get(dimension, value)
+                if new:
+                    dimension_rows.append((key,) + value)
+                fact_rows.append(tuple(key if i is None else row[i] for i in columns))
+            rows[fact] = fact_rows
+            rows[dimension] = dimension_rows
+        return rows
@@ -0,0 +1,222 @@
+#!/usr/bin/env python
+import glob
+import logging
+import os
+import shutil
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import wos_builder.db_info as db_info
+from wos_builder.conversion import write_loader, xml_to_sql
+from wos_builder.sources import (
+    expand_source,
+    open_source,
+    source_patterns,
+    split_member,
+)
+from wos_builder.stats import Stats
+from wos_builder.writers import open_output, output_name
+
+
+def find_source_files(sources, patterns=source_patterns):
+    """Expands a list of files, directories and glob patterns into sources.
+
+    Directories are searched (non-recursively) for files matching one of
+    patterns. Zip archives are replaced by the XML files they contain, see
+    sources.expand_source. The result is sorted and free of duplicates.
+    """
+    if isinstance(sources, (str, os.PathLike)):
+        sources = [sources]
+
+    files = set()
+    for source in sources:
+        source = os.fspath(source)
+        if os.path.isdir(source):
+            for pattern in patterns:
+                files.update(glob.glob(os.path.join(source, pattern)))
+        elif os.path.isfile(source) or split_member(source)[1] is not None:
+            files.add(source)
+        else:
+            files.update(f for f in glob.glob(source) if os.path.isfile(f))
+    return sorted(expanded for source in files for expanded in expand_source(source))
+
+
+def shard_dirs(sourcefiles, datadir):
+    """Assigns each source file its own output folder below datadir."""
+    dirs = {}
+    used = set()
+    for sourcefile in sourcefiles:
+        name = os.path.basename(sourcefile).split(".")[0]
+        shard = name
+        n = 1
+        while shard in used:
+            n += 1
+            shard = "{0}_{1}".format(name, n)
+        used.add(shard)
+        dirs[sourcefile] = os.path.join(datadir, shard)
+    return dirs
+
+
+def _convert_one(sourcefile, shard_dir, kwargs):
+    os.makedirs(shard_dir, exist_ok=True)
+    xml_to_sql(sourcefile, shard_dir, **kwargs)
+    return sourcefile, kwargs.get("stats")
+
+
+def merge_shards(
+    shards,
+    datadir,
+    data_format="sql",
+    compression=None,
+    remove=True,
+    compression_level=None,
+    tables=db_info.tables,
+):
+    """Concatenates the per-file table dumps in shards into datadir.
+
+    Each merged SQL file starts with the table DDL once, followed by the
+    INSERT statements of every shard in the given order. Compressed SQL files
+    are decompressed for this and compressed again with compression_level.
+    TSV and JSON Lines files are concatenated as they are, which also holds
+    for compressed files as gzip members and zstd frames can follow each
+    other. TSV output gets a single loader script. Parquet files cannot be
+    concatenated, instead every table becomes a dataset folder in datadir
+    with one file per shard.
+    """
+    for table_name, file_name, _, sql_header in tables:
+        if data_format == "parquet":
+            dataset = os.path.join(datadir, file_name)
+            os.makedirs(dataset, exist_ok=True)
+            transfer = os.replace if remove else shutil.copyfile
+            for shard in shards:
+                transfer(
+                    os.path.join(shard, output_name(file_name, data_format)),
+                    os.path.join(
+                        dataset, output_name(os.path.basename(shard), data_format)
+                    ),
+                )
+            continue
+
+        file_name = output_name(file_name, data_format, compression)
+        if data_format == "sql" and compression is not None:
+            _merge_compressed_sql(
+                shards,
+                os.path.join(datadir, file_name),
+                sql_header.format(table_name) + "\n",
+                compression,
+                compression_level,
+            )
+            continue
+
+        header = ""
+        if data_format == "sql":
+            header = sql_header.format(table_name) + "\n"
+        skip = len(header.encode())
+        with open(os.path.join(datadir, file_name), "wb") as f_handle:
+            f_handle.write(header.encode())
+            for shard in shards:
+                with open(os.path.join(shard, file_name), "rb") as part:
+                    part.seek(skip)
+                    shutil.copyfileobj(part, f_handle)
+
+    if data_format == "tsv":
+        write_loader(datadir, tables=tables)
+
+    if remove:
+        for shard in shards:
+            shutil.rmtree(shard)
+
+
+def _merge_compressed_sql(shards, path, header, compression, level):
+    file_name = os.path.basename(path)
+    with open_output(path, compression, level=level) as f_handle:
+        f_handle.write(header)
+        f_handle.flush()
+        for shard in shards:
+            with open_source(os.path.join(shard, file_name)) as part:
+                part.seek(len(header.encode()))
+                shutil.copyfileobj(part, f_handle.buffer)
+
+
+def convert_files(sources, datadir, processes=None, merge=False, **kwargs):
+    """Converts many XML files in parallel using a pool of worker processes.
+
+    sources may be a list of files, directories or glob patterns. Every file
+    is written to its own folder in datadir so that workers never share an
+    output file. With merge=True the per-file dumps are combined into a single
+    file per table in datadir afterwards. Additional keyword arguments are
+    passed on to xml_to_sql. With resume=True every folder keeps a manifest,
+    files that were converted before are skipped and the per-file dumps are
+    kept after merging. With a delta_index the files are converted one after
+    the other in sorted order, as each one is compared with the previous.
+    The same holds for dedup with a path and for normalize, while dedup=True
+    only removes the duplicates within each file. With stats_file the Stats
+    of all files are added up and written there as JSON.
+    """
+    sourcefiles = find_source_files(sources)
+    if not sourcefiles:
+        raise ValueError("No source files found in {0}".format(sources))
+
+    dirs = shard_dirs(sourcefiles, datadir)
+    os.makedirs(datadir, exist_ok=True)
+    logging.debug(
+        "Converting {0} files with {1} processes".format(
+            len(sourcefiles), processes or os.cpu_count()
+        )
+    )
+
+    # Every file is compared against the index updated by the previous one
+    shared_index = (
+        kwargs.get("delta_index") is not None
+        or kwargs.get("normalize") is not None
+        or isinstance(kwargs.get("dedup"), (str, os.PathLike))
+    )
+    started = time.perf_counter()
+    stats_file = kwargs.pop("stats_file", None)
+    stats = None if stats_file is None else Stats()
+
+    def file_kwargs():
+        # Every file counts on its own, the counts are added up here
+        return kwargs if stats is None else dict(kwargs, stats=Stats())
+
+    if shared_index:
+        results = (
+            _convert_one(sourcefile, dirs[sourcefile], file_kwargs())
+            for sourcefile in sourcefiles
+        )
+        for sourcefile, file_stats in results:
+            logging.debug("Finished {0}".format(sourcefile))
+            if stats is not None:
+                stats.merge(file_stats)
+    else:
+        with ProcessPoolExecutor(max_workers=processes) as pool:
+            futures = [
+                pool.submit(_convert_one, sourcefile, dirs[sourcefile], file_kwargs())
+                for sourcefile in sourcefiles
+            ]
+            for future in futures:
+                sourcefile, file_stats = future.result()
+                logging.debug("Finished {0}".format(sourcefile))
+                if stats is not None:
+                    stats.merge(file_stats)
+
+    if merge:
+        merge_shards(
+            [dirs[sourcefile] for sourcefile in sourcefiles],
+            datadir,
+            kwargs.get("data_format", "sql"),
+            kwargs.get("compression"),
+            # Resumed runs need the finished shards again
+            remove=not kwargs.get("resume", False),
+            compression_level=kwargs.get("compression_level"),
+            tables=(
+                db_info.tables
+                if kwargs.get("normalize") is None
+                else db_info.normalized_tables
+            ),
+        )
+
+    if stats is not None:
+        stats.seconds = time.perf_counter() - started
+        stats.save(stats_file)
+    return sourcefiles
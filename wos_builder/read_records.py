@@ -1,22 +1,134 @@
 #!/usr/bin/env python
+import contextlib
+import mmap
+import os
+
+REC_START = b"<REC"
+REC_END = b"</REC>"
+# Bytes that may follow the tag name, so that e.g. <RECORDS> is not a match
+_REC_START_FOLLOW = frozenset(b" \t\r\n/>")
 
 
 def get_record(filehandle):
-    record = ""
-    flag = False
+    lines = []
     for line in filehandle:
-        if flag != True and not line.startswith("<REC"):
+        if not lines and not line.startswith("<REC"):
             continue
-        flag = True
 
-        record = record + line
+        lines.append(line)
 
         if line.strip().endswith("</REC>"):
-            return record
+            return "".join(lines)
 
     return None
 
 
+def _find_record_start(buf, pos):
+    """Returns the position of the next <REC tag in buf at or after pos.
+
+    Returns -1 if there is none. A candidate at the very end of buf, whose
+    next byte is not known yet, is returned as a match.
+    """
+    while True:
+        pos = buf.find(REC_START, pos)
+        if pos == -1 or pos + len(REC_START) >= len(buf):
+            return pos
+        if buf[pos + len(REC_START)] in _REC_START_FOLLOW:
+            return pos
+        pos += len(REC_START)
+
+
+def scan_records(buf, pos=0):
+    """Yields the (start, end) positions of all complete records in buf.
+
+    buf can be any bytes-like object with a find method, such as bytes,
+    bytearray or mmap. Record boundaries are found with find, independently
+    of how the records are split across lines.
+    """
+    while True:
+        start = _find_record_start(buf, pos)
+        if start == -1:
+            return
+        end = buf.find(REC_END, start)
+        if end == -1:
+            return
+        pos = end + len(REC_END)
+        yield start, pos
+
+
+def iter_records(filehandle, buffer_size=1 << 22):
+    """Yields (offset, record) for every record in a binary file.
+
+    The file is read in blocks of buffer_size bytes and records are cut from
+    the buffer with bytes.find, so no per-line work is done and every record
+    is copied exactly once. offset is the position of the record in the file.
+    """
+    buf = bytearray()
+    base = 0  # file offset of buf[0]
+    pos = 0  # position in buf up to which all records have been yielded
+    eof = False
+    while not eof:
+        data = filehandle.read(buffer_size)
+        if data:
+            buf += data
+        else:
+            eof = True
+
+        # Records are copied out of a view, as slicing buf would copy twice.
+        # The view must be released before buf is resized.
+        with memoryview(buf) as view:
+            for start, end in scan_records(buf, pos):
+                yield base + start, bytes(view[start:end])
+                pos = end
+
+        # Drop everything before the first incomplete record
+        start = _find_record_start(buf, pos)
+        cut = len(buf) - len(REC_START) if start == -1 else start
+        cut = max(cut, pos)
+        del buf[:cut]
+        base += cut
+        pos = 0
+
+
+@contextlib.contextmanager
+def map_file(path):
+    """Maps an uncompressed file into memory for reading.
+
+    Yields an mmap, or empty bytes for an empty file, which cannot be
+    mapped. The pages are shared with the page cache and with every other
+    process that maps the same file.
+    """
+    with open(path, "rb") as f_handle:
+        if os.fstat(f_handle.fileno()).st_size == 0:
+            yield b""
+            return
+        buf = mmap.mmap(f_handle.fileno(), 0, access=mmap.ACCESS_READ)
+    if hasattr(buf, "madvise"):
+        buf.madvise(mmap.MADV_SEQUENTIAL)
+    try:
+        yield buf
+    finally:
+        try:
+            buf.close()
+        except BufferError:
+            # Records still in use keep the mapping until they are freed
+            pass
+
+
+def iter_mapped_records(path, start=0):
+    """Yields (offset, record) for every record in an uncompressed file.
+
+    Unlike iter_records the file is mapped into memory with map_file and
+    every record is a memoryview of the mapping, so nothing is copied or
+    decoded before the parser sees it. offset is the position of the record
+    in the file and the scan begins at byte start.
+    """
+    with map_file(path) as buf:
+        with memoryview(buf) as view:
+            for begin, end in scan_records(buf, start):
+                yield begin, view[begin:end]
+
+
 if __name__ == "__main__":
     import argparse
 
@@ -0,0 +1,205 @@
+#!/usr/bin/env python
+"""Opening of plain and compressed source files.
+
+Sources can be plain XML files, gzip, bz2 or zstd compressed files, or zip
+archives. The compression is detected from the first bytes of a file, not
+from its name. A single XML file in a zip archive is addressed as
+"archive.zip/member.xml", an archive with only one XML file also by its own
+path. Compressed data is decompressed while it is read, in a background
+thread that stays a few blocks ahead of the parser.
+"""
+
+import bz2
+import gzip
+import io
+import os
+import queue
+import threading
+import zipfile
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Leading bytes of each supported compressed format
+magic_numbers = {
+    b"\x1f\x8b": "gzip",
+    b"BZh": "bz2",
+    b"\x28\xb5\x2f\xfd": "zstd",
+    b"PK\x03\x04": "zip",
+}
+
+# File name patterns of sources in a folder
+source_patterns = ["*.xml", "*.xml.gz", "*.xml.bz2", "*.xml.zst", "*.zip"]
+
+
+def split_member(source):
+    """Returns (archive, member) for "archive.zip/member", else (source, None)."""
+    source = os.fspath(source)
+    if not os.path.exists(source):
+        archive, sep, member = source.partition(".zip/")
+        if sep and os.path.isfile(archive + ".zip"):
+            return archive + ".zip", member
+    return source, None
+
+
+def source_file(source):
+    """Returns the path of the file on disk that holds source."""
+    return split_member(source)[0]
+
+
+def detect_compression(path):
+    """Returns the compression of a file as key of magic_numbers, or None."""
+    with open(path, "rb") as f_handle:
+        head = f_handle.read(4)
+    for magic, compression in magic_numbers.items():
+        if head.startswith(magic):
+            return compression
+    return None
+
+
+def is_plain(source):
+    """Returns True if source is an uncompressed file on disk, which can be
+    read at any offset without decompressing everything before it."""
+    path, member = split_member(source)
+    return member is None and detect_compression(path) is None
+
+
+def zip_members(path):
+    """Returns the XML files in a zip archive, in the order they are stored."""
+    with zipfile.ZipFile(path) as archive:
+        return [
+            info.filename
+            for info in archive.infolist()
+            if not info.is_dir() and info.filename.endswith(".xml")
+        ]
+
+
+def expand_source(source):
+    """Returns the sources in source, which are its XML members for a zip."""
+    path, member = split_member(source)
+    if member is None and detect_compression(path) == "zip":
+        return [os.path.join(path, member) for member in zip_members(path)]
+    return [os.fspath(source)]
+
+
+def open_source(source, read_ahead=True):
+    """Opens source for reading its uncompressed bytes.
+
+    Plain files are opened as they are. Compressed files and zip members are
+    decompressed on the fly, by a ReadAhead thread unless read_ahead is
+    False. They only support seeking forward.
+    """
+    path, member = split_member(source)
+    compression = "zip" if member is not None else detect_compression(path)
+    if compression is None:
+        return open(path, "rb")
+
+    if compression == "zip":
+        if member is None:
+            members = zip_members(path)
+            if len(members) != 1:
+                raise ValueError(
+                    "{0} holds {1} XML files, open one of them as {0}/<member>".format(
+                        path, len(members)
+                    )
+                )
+            member = members[0]
+        # The member keeps the archive file open until it is closed itself
+        with zipfile.ZipFile(path) as archive:
+            data = archive.open(member)
+    elif compression == "gzip":
+        data = gzip.open(path, "rb")
+    elif compression == "bz2":
+        data = bz2.open(path, "rb")
+    elif compression == "zstd":
+        if zstandard is None:
+            raise ImportError("Reading zstd files requires the zstandard package")
+        data = zstandard.ZstdDecompressor().stream_reader(
+            open(path, "rb"), read_across_frames=True, closefd=True
+        )
+
+    return ReadAhead(data) if read_ahead else data
+
+
+class ReadAhead(io.RawIOBase):
+    """Reads a file object in a background thread.
+
+    Up to blocks blocks of block_size bytes are read ahead of the consumer,
+    so decompression, which releases the GIL, runs while the data that was
+    read before is parsed. Seeking is only possible forward.
+    """
+
+    def __init__(self, data, block_size=1 << 20, blocks=8):
+        self.data = data
+        self.block_size = block_size
+        self.blocks = queue.Queue(blocks)
+        self.block = memoryview(b"")
+        self.position = 0
+        self.error = None
+        self.eof = False
+        self.stopped = False
+        self.thread = threading.Thread(target=self._fill, daemon=True)
+        self.thread.start()
+
+    def _fill(self):
+        try:
+            while not self.stopped:
+                block = self.data.read(self.block_size)
+                self.blocks.put(block)
+                if not block:
+                    return
+        except Exception as e:
+            self.error = e
+            self.blocks.put(b"")
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def readinto(self, buffer):
+        if not self.block:
+            if self.eof:
+                return 0
+            self.block = memoryview(self.blocks.get())
+            if not self.block:
+                self.eof = True
+                if self.error is not None:
+                    raise self.error
+                return 0
+        n = min(len(buffer), len(self.block))
+        buffer[:n] = self.block[:n]
+        self.block = self.block[n:]
+        self.position += n
+        return n
+
+    def tell(self):
+        return self.position
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self.position
+        elif whence != io.SEEK_SET:
+            raise io.UnsupportedOperation("can only seek from the start")
+        if offset < self.position:
+            raise io.UnsupportedOperation("can only seek forward")
+        while self.position < offset:
+            if not self.read(min(offset - self.position, self.block_size)):
+                break
+        return self.position
+
+    def close(self):
+        if self.closed:
+            return
+        self.stopped = True
+        # Unblock the thread if it waits for space in the queue
+        while self.thread.is_alive():
+            try:
+                self.blocks.get(timeout=0.1)
+            except queue.Empty:
+                pass
+        self.data.close()
+        super().close()
@@ -0,0 +1,177 @@
+#!/usr/bin/env python
+"""Timing and throughput counters of a conversion.
+
+A Stats object is filled while xml_to_sql runs, if one is given. It
+measures the seconds spent in every stage of the pipeline:
+
+    read       cutting records out of the input (scan reader)
+    parse      turning records into elements, or all of iterparse
+    extract    turning elements into rows, per extract_* function in extractors
+    normalize  splitting rows with a Normalizer
+    dedup      dropping duplicates with a Deduplicator
+    wait       waiting for worker processes, whose parse and extract times
+               are added up, so that they can exceed the total time
+    write      everything outside the stages above, mostly serializing and
+               writing rows
+
+together with the number of records, bytes of input (uncompressed, except
+for the iterparse reader), rows per table handed to the writers and the
+peak resident memory. Without a Stats object none of this is
+measured.
+"""
+
+import collections
+import contextlib
+import json
+import logging
+import sys
+import time
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+
+def peak_rss():
+    """Returns the peak resident memory of this process or of any of its
+    finished child processes in bytes, or None if it is not available."""
+    if resource is None:
+        return None
+    peak = max(
+        resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss,
+    )
+    # Linux reports KiB, macOS bytes
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+class Stats:
+    """Counters of one or more conversions.
+
+    callback is called with the summary every interval seconds while rows
+    are written and once more at the end of every conversion.
+    """
+
+    def __init__(self, callback=None, interval=10.0):
+        self.callback = callback
+        self.interval = interval
+        self.stages = collections.Counter()
+        self.extractors = collections.Counter()
+        self.rows = collections.Counter()
+        self.records = 0
+        self.bytes = 0
+        self.seconds = 0.0
+        self.source_seconds = 0.0
+        self.started = None
+        self.last_report = None
+
+    def __getstate__(self):
+        # Worker processes only send their times back
+        state = self.__dict__.copy()
+        state["callback"] = None
+        return state
+
+    def start(self):
+        self.started = self.last_report = time.perf_counter()
+        self.source_seconds = 0.0
+
+    def stop(self):
+        seconds = time.perf_counter() - self.started
+        self.seconds += seconds
+        self.started = None
+        self.stages["write"] += seconds - self.source_seconds
+        logging.debug("Conversion stats: {0}".format(self.summary()))
+        if self.callback is not None:
+            self.callback(self.summary())
+
+    @contextlib.contextmanager
+    def timer(self, stage):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stages[stage] += time.perf_counter() - started
+
+    def timed(self, iterable, stage):
+        """Yields from iterable and adds the time spent in it to stage."""
+        iterator = iter(iterable)
+        while True:
+            started = time.perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+            finally:
+                self.stages[stage] += time.perf_counter() - started
+            yield item
+
+    def source(self, records):
+        """Yields from records, the time outside of it counts as writing."""
+        iterator = iter(records)
+        while True:
+            started = time.perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+            finally:
+                self.source_seconds += time.perf_counter() - started
+            yield item
+
+    def timed_call(self, function, stage):
+        """Returns function with the time of every call added to stage."""
+
+        def timed(*args):
+            with self.timer(stage):
+                return function(*args)
+
+        return timed
+
+    def call(self, function, *args):
+        """Calls an extract_* function and adds its time to extractors."""
+        started = time.perf_counter()
+        try:
+            return function(*args)
+        finally:
+            self.extractors[function.__name__] += time.perf_counter() - started
+
+    def merge(self, other):
+        """Adds the counters of other, e.g. of a worker, except its seconds."""
+        self.stages.update(other.stages)
+        self.extractors.update(other.extractors)
+        self.rows.update(other.rows)
+        self.records += other.records
+        self.bytes += other.bytes
+
+    def count(self, rows):
+        """Counts the rows of a record that are written and reports if due."""
+        for table_name, table_rows in rows.items():
+            self.rows[table_name] += len(table_rows)
+        if self.callback is not None:
+            now = time.perf_counter()
+            if now - self.last_report >= self.interval:
+                self.last_report = now
+                self.callback(self.summary())
+        return rows
+
+    def summary(self):
+        """Returns all counters as a dict that can be stored as JSON."""
+        seconds = self.seconds
+        if self.started is not None:
+            seconds += time.perf_counter() - self.started
+        return {
+            "seconds": seconds,
+            "records": self.records,
+            "bytes": self.bytes,
+            "records_per_second": self.records / seconds if seconds else 0.0,
+            "bytes_per_second": self.bytes / seconds if seconds else 0.0,
+            "stages": dict(self.stages),
+            "extractors": dict(self.extractors),
+            "rows": dict(self.rows),
+            "peak_rss": peak_rss(),
+        }
+
+    def save(self, path):
+        with open(path, "w") as f_handle:
+            json.dump(self.summary(), f_handle, indent=1)
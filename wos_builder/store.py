@@ -0,0 +1,33 @@
+#!/usr/bin/env python
+"""State kept in a SQLite database next to the output."""
+
+import sqlite3
+
+
+class SqliteStore:
+    """A SQLite database at path, created with schema if it does not exist.
+
+    Changes only become permanent with commit, so the state can be kept in
+    step with the output written so far. Without a path there is no database
+    and commit and close do nothing.
+    """
+
+    def __init__(self, path, schema):
+        self.db = None
+        if path is not None:
+            self.db = sqlite3.connect(path)
+            self.db.execute(schema)
+
+    def commit(self):
+        if self.db is not None:
+            self.db.commit()
+
+    def close(self):
+        if self.db is not None:
+            self.db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,819 @@
+#!/usr/bin/env python
+import collections
+import io
+import json
+import logging
+import queue
+import threading
+import zlib
+
+from wos_builder.db_info import column_types
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+
+def mysql_string(value):
+    """Returns value as a MySQL string literal, or NULL for None and "NULL"."""
+    if value is None or value == "NULL":
+        return "NULL"
+    value = str(value)
+    if "\\" in value:
+        value = value.replace("\\", "\\\\")
+    if "'" in value:
+        value = value.replace("'", "\\'")
+    if "\n" in value:
+        value = value.replace("\n", "\\n")
+    if "\r" in value:
+        value = value.replace("\r", "\\r")
+    if "\0" in value:
+        value = value.replace("\0", "\\0")
+    if "\x1a" in value:
+        value = value.replace("\x1a", "\\Z")
+    return "'" + value + "'"
+
+
+def mysql_int(value):
+    """Returns value as a bare MySQL integer if it is one, else as mysql_string."""
+    if isinstance(value, str) and value.isascii() and value.isdigit():
+        return value
+    if isinstance(value, int):
+        return str(value)
+    return mysql_string(value)
+
+
+def row_encoder(header, sql_header):
+    """Returns a function that renders a row tuple as a MySQL VALUES tuple.
+
+    The literal encoder of every column is chosen once from its type in the
+    DDL template: int columns get mysql_int, everything else mysql_string.
+    """
+    types = column_types(sql_header)
+    encoders = [
+        mysql_int if types.get(column, "").startswith("int") else mysql_string
+        for column in header
+    ]
+    if all(encoder is mysql_string for encoder in encoders):
+        return _string_row
+    return lambda row: "(" + ",".join(map(_call, encoders, row)) + ")"
+
+
+def _call(encoder, value):
+    return encoder(value)
+
+
+def _string_row(row):
+    """Encodes a row of string columns, quoting the whole row at once.
+
+    Rows without None values and without characters that need escaping
+    (which covers almost all of them) are joined in one go; only the others
+    are encoded value by value.
+    """
+    if None not in row:
+        try:
+            joined = "','".join(row)
+        except TypeError:
+            joined = None
+        if (
+            joined is not None
+            and joined.count("'") == 2 * (len(row) - 1)
+            and "\\" not in joined
+            and "\n" not in joined
+            and "\r" not in joined
+            and "\0" not in joined
+            and "\x1a" not in joined
+        ):
+            joined = "('" + joined + "')"
+            if "'NULL'" in joined:
+                # Without quotes in the values this can only be a whole value
+                joined = joined.replace("'NULL'", "NULL")
+            return joined
+    return "(" + ",".join(map(mysql_string, row)) + ")"
+
+
+def dict_row(row, header):
+    """Returns a dict row as a tuple ordered like header, "NULL" if missing."""
+    return tuple(map(row.get, header, ("NULL",) * len(header)))
+
+
+def to_rows(rows, header):
+    """Returns rows as tuples ordered like header.
+
+    Dict rows are converted with dict_row, tuples are passed through as is.
+    """
+    nulls = ("NULL",) * len(header)
+    return [
+        tuple(map(row.get, header, nulls)) if isinstance(row, dict) else row
+        for row in rows
+    ]
+
+
+# Just below the 4 MiB default max_allowed_packet of MySQL 5.7
+DEFAULT_MAX_BYTES = 4 * 1024 * 1024 - 1024
+
+# File name suffix by output compression
+compressions = {None: "", "gzip": ".gz", "zstd": ".zst"}
+
+# Compression level used if none is given
+default_levels = {"gzip": 6, "zstd": 3}
+
+
+class CompressedOutput(io.RawIOBase):
+    """A binary file that is compressed with gzip or zstd in the background.
+
+    Written data is put into a queue of up to queue_size blocks and a thread
+    compresses it and writes it to file_name, so the compression, which
+    releases the GIL, does not hold up the writer. With append=True a new
+    gzip member or zstd frame is added to an existing file. Errors of the
+    thread are raised by the next write or by close.
+    """
+
+    def __init__(self, file_name, compression, level=None, append=False, queue_size=16):
+        if level is None:
+            level = default_levels.get(compression)
+        if compression == "gzip":
+            # wbits=31 writes a gzip header and trailer
+            self.compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+        elif compression == "zstd":
+            if zstandard is None:
+                raise ImportError("zstd compression requires the zstandard package")
+            self.compressor = zstandard.ZstdCompressor(level=level).compressobj()
+        else:
+            raise ValueError("Unknown compression: {0}".format(compression))
+        self.f_handle = open(file_name, "ab" if append else "wb")
+        self.blocks = queue.Queue(queue_size)
+        self.error = None
+        self.thread = threading.Thread(target=self._compress, daemon=True)
+        self.thread.start()
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._raise_error()
+        self.blocks.put(bytes(data))
+        return len(data)
+
+    def close(self):
+        if self.closed:
+            return
+        try:
+            super().close()
+        finally:
+            self.blocks.put(None)
+            self.thread.join()
+            self.f_handle.close()
+        self._raise_error()
+
+    def _raise_error(self):
+        if self.error is not None:
+            raise self.error
+
+    def _compress(self):
+        while (block := self.blocks.get()) is not None:
+            if self.error is not None:
+                continue
+            try:
+                self.f_handle.write(self.compressor.compress(block))
+            except Exception as e:
+                self.error = e
+        if self.error is None:
+            try:
+                self.f_handle.write(self.compressor.flush())
+            except Exception as e:
+                self.error = e
+
+
+def open_output(file_name, compression=None, append=False, level=None):
+    """Opens file_name for writing UTF-8 text, optionally gzip or zstd compressed.
+
+    Compressed files are written through a CompressedOutput with the given
+    compression level, zstd needs the zstandard package. With append=True
+    the file is appended to.
+    """
+    if compression is None:
+        return open(file_name, "a" if append else "w", encoding="utf-8", newline="")
+    return io.TextIOWrapper(
+        io.BufferedWriter(
+            CompressedOutput(file_name, compression, level, append), 1 << 20
+        ),
+        encoding="utf-8",
+        newline="",
+    )
+
+
+class SqlWriter:
+    """Writes the rows of one table as batched INSERT statements.
+
+    Rows are tuples with one value per column in header. They are encoded as
+    they arrive and a statement is written as soon as it holds batch_size
+    rows or adding the next row would make it longer than max_bytes bytes.
+    Either limit can be None to disable it. Only one statement per table is
+    ever held in memory. With append=True the rows are added to an existing
+    file, which already starts with the DDL. The file can be compressed, see
+    open_output.
+    """
+
+    extension = "sql"
+    appendable = True
+    # Compressed by a stream around the file, which gets a suffix
+    compression_mode = "stream"
+
+    def __init__(
+        self,
+        header,
+        sql_header,
+        table_name,
+        file_name,
+        batch_size=None,
+        max_bytes=DEFAULT_MAX_BYTES,
+        append=False,
+        compression=None,
+        compression_level=None,
+    ):
+        if batch_size is not None and batch_size < 1:
+            raise ValueError("batch_size must be at least one")
+        if max_bytes is not None and max_bytes < 1:
+            raise ValueError("max_bytes must be at least one")
+        self.header = header
+        self.encode_row = row_encoder(header, sql_header)
+        self.table_name = table_name
+        self.file_name = file_name
+        self.batch_size = batch_size
+        self.max_bytes = max_bytes
+        self.prefix = "INSERT IGNORE INTO {0} ({1})\nVALUES\n".format(
+            table_name, ", ".join(header)
+        )
+        self.pending = []
+        self.pending_bytes = len(self.prefix.encode())
+        self.delete_prefix = "DELETE FROM {0} WHERE {1} IN (".format(
+            table_name, header[0]
+        )
+        self.deletes = []
+        self.delete_bytes = len(self.delete_prefix) + 3
+        self.f_handle = open_output(file_name, compression, append, compression_level)
+        if not append:
+            self.f_handle.write(sql_header.format(table_name))
+            self.f_handle.write("\n")
+
+    def write(self, rows):
+        for row in rows:
+            encoded = self.encode_row(row)
+            # Every row is followed by ",\n" or ";\n"
+            size = len(encoded) + 2
+            if not encoded.isascii():
+                size = len(encoded.encode()) + 2
+
+            if (
+                self.max_bytes is not None
+                and self.pending_bytes + size > self.max_bytes
+            ):
+                if self.pending:
+                    self._write_batch()
+                if self.pending_bytes + size > self.max_bytes:
+                    logging.warning(
+                        "Row of {0} bytes exceeds max_bytes for {1}".format(
+                            size, self.table_name
+                        )
+                    )
+
+            self.pending.append(encoded)
+            self.pending_bytes += size
+            if self.batch_size is not None and len(self.pending) >= self.batch_size:
+                self._write_batch()
+
+    def delete(self, keys):
+        """Deletes the rows whose first column is one of keys.
+
+        The DELETE statement is written before the next INSERT statement, so
+        rows passed to write after this call replace the deleted ones. Rows
+        passed to write before are written first, so that they are deleted
+        too.
+        """
+        if self.pending:
+            self._write_batch()
+        for key in keys:
+            encoded = mysql_string(key)
+            size = len(encoded.encode()) + 1
+            if (
+                self.max_bytes is not None
+                and self.deletes
+                and self.delete_bytes + size > self.max_bytes
+            ):
+                self._write_batch()
+            self.deletes.append(encoded)
+            self.delete_bytes += size
+
+    def flush(self):
+        if self.pending or self.deletes:
+            self._write_batch()
+        self.f_handle.flush()
+
+    def close(self):
+        if self.f_handle.closed:
+            return
+        try:
+            self.flush()
+        finally:
+            self.f_handle.close()
+
+    def _write_batch(self):
+        if self.deletes:
+            self.f_handle.write(self.delete_prefix + ",".join(self.deletes) + ");\n")
+            self.deletes = []
+            self.delete_bytes = len(self.delete_prefix) + 3
+        if self.pending:
+            self.f_handle.write(self.prefix + ",\n".join(self.pending) + ";\n")
+            self.pending = []
+            self.pending_bytes = len(self.prefix.encode())
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def tsv_value(value):
+    """Returns value escaped for a LOAD DATA file, \\N for None and "NULL"."""
+    if value is None or value == "NULL":
+        return "\\N"
+    value = str(value)
+    if "\\" in value:
+        value = value.replace("\\", "\\\\")
+    if "\t" in value:
+        value = value.replace("\t", "\\t")
+    if "\n" in value:
+        value = value.replace("\n", "\\n")
+    if "\r" in value:
+        value = value.replace("\r", "\\r")
+    if "\0" in value:
+        value = value.replace("\0", "\\0")
+    if "\x1a" in value:
+        value = value.replace("\x1a", "\\Z")
+    return value
+
+
+def tsv_row(row):
+    """Returns a row as one tab-separated line in the default LOAD DATA format."""
+    if None not in row and "NULL" not in row:
+        try:
+            joined = "\t".join(row)
+        except TypeError:
+            joined = None
+        if (
+            joined is not None
+            and joined.count("\t") == len(row) - 1
+            and "\\" not in joined
+            and "\n" not in joined
+            and "\r" not in joined
+            and "\0" not in joined
+            and "\x1a" not in joined
+        ):
+            return joined + "\n"
+    return "\t".join(map(tsv_value, row)) + "\n"
+
+
+class _LineWriter:
+    """Base class for writers that encode every row as one line of text.
+
+    Lines are buffered and written once batch_size rows or max_bytes bytes
+    have accumulated. Subclasses implement encode_line.
+    """
+
+    appendable = True
+    compression_mode = "stream"
+
+    def __init__(
+        self,
+        header,
+        sql_header,
+        table_name,
+        file_name,
+        batch_size=None,
+        max_bytes=DEFAULT_MAX_BYTES,
+        append=False,
+        compression=None,
+        compression_level=None,
+    ):
+        self.header = header
+        self.table_name = table_name
+        self.file_name = file_name
+        self.batch_size = batch_size
+        self.max_bytes = max_bytes
+        self.pending = []
+        self.pending_bytes = 0
+        self.f_handle = open_output(file_name, compression, append, compression_level)
+
+    def write(self, rows):
+        encode_line = self.encode_line
+        for row in rows:
+            line = encode_line(row)
+            self.pending.append(line)
+            self.pending_bytes += len(line)
+            if (
+                self.batch_size is not None and len(self.pending) >= self.batch_size
+            ) or (self.max_bytes is not None and self.pending_bytes >= self.max_bytes):
+                self._write_batch()
+
+    def flush(self):
+        if self.pending:
+            self._write_batch()
+        self.f_handle.flush()
+
+    def close(self):
+        if self.f_handle.closed:
+            return
+        try:
+            self.flush()
+        finally:
+            self.f_handle.close()
+
+    def _write_batch(self):
+        self.f_handle.write("".join(self.pending))
+        self.pending = []
+        self.pending_bytes = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class TsvWriter(_LineWriter):
+    """Writes the rows of one table as a tab-separated file for LOAD DATA.
+
+    Values are escaped as expected by LOAD DATA with its default FIELDS and
+    LINES options and NULL is written as \\N. The DDL is not part of the file,
+    see conversion.write_loader.
+    """
+
+    extension = "tsv"
+    # LOAD DATA cannot read compressed files
+    compression_mode = None
+
+    def encode_line(self, row):
+        return tsv_row(row)
+
+
+def python_value(value, integer=False):
+    """Returns value as a plain Python value, None for None and "NULL".
+
+    With integer=True strings of digits are returned as int.
+    """
+    if value is None or value == "NULL":
+        return None
+    if integer and isinstance(value, str) and value.isascii() and value.isdigit():
+        return int(value)
+    return value
+
+
+class JsonlWriter(_LineWriter):
+    """Writes the rows of one table as JSON Lines, one object per row.
+
+    Objects are keyed by column name. NULL becomes null and the values of
+    int columns in the DDL are written as numbers. The file can be
+    compressed, see open_output.
+
+    As in ParquetWriter, values of int columns that are not integers in the
+    range of the column type are written as null, so every column has one
+    JSON type. They are counted per column in lost and a warning is logged
+    when the writer is closed.
+    """
+
+    extension = "jsonl"
+
+    def __init__(self, header, sql_header, *args, **kwargs):
+        super().__init__(header, sql_header, *args, **kwargs)
+        types = column_types(sql_header)
+        self.int_ranges = [int_range(types.get(column, "")) for column in header]
+        self.lost = collections.Counter()
+
+    def encode_line(self, row):
+        values = {}
+        for column, value, bounds in zip(self.header, row, self.int_ranges):
+            value = python_value(value)
+            if bounds is not None and value is not None:
+                number = _int_value(value, *bounds)
+                if number is None:
+                    self.lost[column] += 1
+                value = number
+            values[column] = value
+        return json.dumps(values, ensure_ascii=False) + "\n"
+
+    def close(self):
+        if self.f_handle.closed:
+            return
+        super().close()
+        _warn_lost(self.table_name, self.lost)
+
+
+def int_range(sql_type):
+    """Returns the smallest and largest value of an int column of sql_type.
+
+    int unsigned columns hold uint32 and int columns int64 values, as in
+    arrow_schema. Returns None for columns of other types.
+    """
+    if not sql_type.startswith("int"):
+        return None
+    if sql_type.endswith("unsigned"):
+        return 0, 2**32 - 1
+    return -(2**63), 2**63 - 1
+
+
+def _warn_lost(table_name, lost):
+    for column, count in lost.items():
+        logging.warning(
+            "{0} values of {1}.{2} are not integers of its type and were "
+            "written as null".format(count, table_name, column)
+        )
+
+
+def arrow_schema(header, sql_header):
+    """Returns the Arrow schema of a table from its t_* DDL template.
+
+    int unsigned columns become uint32, int columns int64 and everything
+    else string. All fields are nullable.
+    """
+    types = column_types(sql_header)
+    fields = []
+    for column in header:
+        sql_type = types.get(column, "")
+        if sql_type.startswith("int") and sql_type.endswith("unsigned"):
+            arrow_type = pyarrow.uint32()
+        elif sql_type.startswith("int"):
+            arrow_type = pyarrow.int64()
+        else:
+            arrow_type = pyarrow.string()
+        fields.append(pyarrow.field(column, arrow_type))
+    return pyarrow.schema(fields)
+
+
+def _string_column(values):
+    return [None if value == "NULL" else value for value in values]
+
+
+def _int_column(values, minimum, maximum):
+    """Returns values as ints and the number of values that were lost.
+
+    Values that are not integers between minimum and maximum, like the
+    article number "e1234" as first page, cannot be stored and become null.
+    """
+    column = []
+    lost = 0
+    for value in values:
+        if value is None or value == "NULL":
+            column.append(None)
+            continue
+        number = _int_value(value, minimum, maximum)
+        if number is None:
+            lost += 1
+        column.append(number)
+    return column, lost
+
+
+def _int_value(value, minimum, maximum):
+    """Returns value as int, or None if it is no integer between minimum and maximum."""
+    number = None
+    if isinstance(value, int):
+        number = value
+    elif isinstance(value, str) and value.isascii() and value.lstrip("-").isdigit():
+        number = int(value)
+    if number is None or not minimum <= number <= maximum:
+        return None
+    return number
+
+
+# Range of the values of every Arrow int type in arrow_schema
+_int_ranges = (
+    {}
+    if pyarrow is None
+    else {
+        pyarrow.uint32(): int_range("int unsigned"),
+        pyarrow.int64(): int_range("int"),
+    }
+)
+
+# Rows per Parquet row group if no batch_size is given
+DEFAULT_ROW_GROUP_SIZE = 64 * 1024
+
+
+class ParquetWriter:
+    """Writes the rows of one table to a Parquet file.
+
+    Column types are taken from the DDL, see arrow_schema, and NULL is
+    written as null. Rows are buffered and written as one row group of
+    batch_size rows (DEFAULT_ROW_GROUP_SIZE by default). Row groups carry
+    min/max statistics per column, so small groups of records that arrive
+    roughly in wos_id and pubyear order let readers skip most of a file
+    when filtering on these columns. max_bytes is ignored. compression
+    selects the codec of the column chunks instead of the default snappy.
+    Requires pyarrow.
+
+    Values of int columns that are not integers in the range of the column
+    type are written as null. They are counted per column in lost and a
+    warning is logged when the writer is closed.
+    """
+
+    extension = "parquet"
+    appendable = False
+    # Compressed inside the file, which keeps its name
+    compression_mode = "internal"
+
+    def __init__(
+        self,
+        header,
+        sql_header,
+        table_name,
+        file_name,
+        batch_size=None,
+        max_bytes=DEFAULT_MAX_BYTES,
+        compression=None,
+        compression_level=None,
+    ):
+        if pyarrow is None:
+            raise ImportError("Parquet output requires the pyarrow package")
+        if batch_size is not None and batch_size < 1:
+            raise ValueError("batch_size must be at least one")
+        self.header = header
+        self.table_name = table_name
+        self.file_name = file_name
+        self.batch_size = batch_size or DEFAULT_ROW_GROUP_SIZE
+        self.schema = arrow_schema(header, sql_header)
+        self.lost = collections.Counter()
+        self.pending = []
+        self.writer = pyarrow.parquet.ParquetWriter(
+            str(file_name),
+            self.schema,
+            compression=compression or "snappy",
+            compression_level=compression_level,
+            write_page_index=True,
+        )
+
+    def write(self, rows):
+        for row in rows:
+            self.pending.append(row)
+            if len(self.pending) >= self.batch_size:
+                self._write_batch()
+
+    def flush(self):
+        if self.pending:
+            self._write_batch()
+
+    def close(self):
+        if not self.writer.is_open:
+            return
+        try:
+            self.flush()
+        finally:
+            self.writer.close()
+        _warn_lost(self.table_name, self.lost)
+
+    def _write_batch(self):
+        arrays = []
+        for values, field in zip(zip(*self.pending), self.schema):
+            if pyarrow.types.is_string(field.type):
+                values = _string_column(values)
+            else:
+                values, lost = _int_column(values, *_int_ranges[field.type])
+                if lost:
+                    self.lost[field.name] += lost
+            arrays.append(pyarrow.array(values, type=field.type))
+        self.writer.write_batch(
+            pyarrow.record_batch(arrays, schema=self.schema),
+            row_group_size=len(self.pending),
+        )
+        self.pending = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+# Writer classes by output format
+formats = {
+    "sql": SqlWriter,
+    "tsv": TsvWriter,
+    "jsonl": JsonlWriter,
+    "parquet": ParquetWriter,
+}
+
+
+def output_name(file_name, data_format="sql", compression=None):
+    """Returns the name of a table file with the extension of its format."""
+    writer = formats[data_format]
+    suffix = compressions[compression] if writer.compression_mode == "stream" else ""
+    return "{0}.{1}{2}".format(file_name, writer.extension, suffix)
+
+
+# Batches of rows queued per table by a BackgroundWriter, and rows per batch
+DEFAULT_QUEUE_SIZE = 16
+DEFAULT_BATCH_ROWS = 1000
+
+
+class BackgroundWriter:
+    """Runs the writes of another writer in a background thread.
+
+    Rows passed to write are collected into batches of batch_rows rows,
+    which are put into a queue of up to queue_size batches and written in
+    order by a thread, so that slow storage does not hold up the parsing. A
+    full queue blocks the caller until the thread catches up, which keeps
+    memory bounded. flush waits for the queue to be empty. Like for
+    CompressedOutput, errors of the thread are raised by the next call and
+    by close.
+    """
+
+    def __init__(
+        self, writer, queue_size=DEFAULT_QUEUE_SIZE, batch_rows=DEFAULT_BATCH_ROWS
+    ):
+        self.writer = writer
+        self.file_name = writer.file_name
+        self.batch_rows = batch_rows
+        self.pending = []
+        self.tasks = queue.Queue(queue_size)
+        self.error = None
+        self.closed = False
+        self.thread = threading.Thread(target=self._work, daemon=True)
+        self.thread.start()
+
+    def write(self, rows):
+        if not self.pending and isinstance(rows, list) and len(rows) >= self.batch_rows:
+            # Large lists, like whole tables, are passed on without a copy
+            self._put(self.writer.write, rows)
+            return
+        self.pending.extend(rows)
+        if len(self.pending) >= self.batch_rows:
+            self._put_pending()
+
+    def delete(self, keys):
+        if keys:
+            # Deletes are ordered before the rows written after them
+            self._put_pending()
+            self._put(self.writer.delete, list(keys))
+
+    def flush(self):
+        self._put_pending()
+        self._put(self.writer.flush)
+        self.tasks.join()
+        self._raise_error()
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        try:
+            if self.pending:
+                self.tasks.put((self.writer.write, (self.pending,)))
+                self.pending = []
+            self.tasks.put(None)
+            self.thread.join()
+        finally:
+            try:
+                self.writer.close()
+            except Exception:
+                # The error of the thread is the one to report
+                if self.error is None:
+                    raise
+        self._raise_error()
+
+    def _put_pending(self):
+        if self.pending:
+            rows, self.pending = self.pending, []
+            self._put(self.writer.write, rows)
+
+    def _put(self, method, *args):
+        self._raise_error()
+        self.tasks.put((method, args))
+
+    def _raise_error(self):
+        if self.error is not None:
+            raise self.error
+
+    def _work(self):
+        while (task := self.tasks.get()) is not None:
+            method, args = task
+            # After an error the queue is only drained, so the caller never blocks
+            if self.error is None:
+                try:
+                    method(*args)
+                except Exception as e:
+                    self.error = e
+            self.tasks.task_done()
+        self.tasks.task_done()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()